@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 import os
 
 from tqdm import tqdm
+from id_converter import IdCache
 # Setting up logging
 # Configure your own logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
@@ -141,6 +142,15 @@ def get_pubmed_abstracts_paged(query, start_date, end_date,
     return abstracts
 
 
+def cache_article_ids(abstracts):
+    """Share the PMID/PMC/DOI triples PubMed returned with the later stages."""
+    cache = IdCache()
+    try:
+        cache.store([{'pmid': a['pmid'], 'pmc': a['pmc'], 'doi': a['doi']} for a in abstracts], source="pubmed")
+    finally:
+        cache.close()
+
+
 def analyze_with_claudia(title, abstract):
     """
     Uses Anthropic's Claude model to extract onboarding-related data from abstract.
@@ -267,6 +277,7 @@ def main():
                                            start_date,
                                            end_date,
                                            total_limit=total_limit)
+    cache_article_ids(abstracts)
     final_results = []
 
     for i, entry in enumerate(abstracts, start=1):
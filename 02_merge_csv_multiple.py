@@ -1,7 +1,556 @@
 
 import pandas as pd
+import numpy as np
 import os
 import argparse
+import hashlib
+import json
+import sqlite3
+import csv
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pandas reader in a process pool is used instead
+    pa = None
+    pa_csv = None
+
+# Bump when the manifest layout or the per-file parsing changes so stale
+# manifests are rebuilt instead of silently reused.
+MANIFEST_VERSION = 5
+KEY_COLUMN = 'Title'
+ABSTRACT_COLUMN = 'Abstract'
+
+# MinHash/LSH settings for --fuzzy_dedup: word 3-gram shingles, 128 hash
+# permutations split into 32 bands of 4 rows. Pairs sharing a band bucket are
+# then verified against the similarity threshold. The hashes and coefficients
+# are below the 31-bit prime, so a * h + b stays under 2^63 in uint64.
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+LSH_BANDS = 32
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_perm_rng = np.random.default_rng(1)
+PERM_A = _perm_rng.integers(1, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _perm_rng.integers(0, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+
+# Columns written by 01_dual_llm_pubmed_analysis.py. Everything is read as
+# text (no dtype inference); 'flag' columns are normalized to True/False/''
+# and 'text' columns are the heavy ones that are only loaded for the rows
+# that end up in the merged output.
+STAGE01_SCHEMA = {
+    "Title": "string",
+    "Abstract": "text",
+    "Authors": "text",
+    "Journal": "string",
+    "Year": "string",
+    "PMID": "string",
+    "PMC": "string",
+    "DOI": "string",
+    "pubmed_url": "string",
+    "pmc_url": "string",
+    "ClaudiaIsRelated": "flag",
+    "ClaudiaStrategy": "text",
+    "ClaudiaPopulation": "text",
+    "ClaudiaOutcome": "text",
+    "OpenAIIsRelated": "flag",
+    "OpenAIStrategy": "text",
+    "OpenAIPopulation": "text",
+    "OpenAIOutcome": "text",
+}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_manifest(manifest_path, match_columns, match_value, fuzzy=False):
+    """
+    Open (or create) the merge manifest database.
+    The manifest is rebuilt from scratch when its version or the matching
+    parameters differ from the current run, since stored votes depend on them.
+    """
+    conn = sqlite3.connect(manifest_path)
+    params = json.dumps({'match_columns': match_columns, 'match_value': match_value, 'fuzzy': fuzzy})
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    stored = None
+    if version == MANIFEST_VERSION:
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE name = 'params'").fetchone()
+            stored = row[0] if row else None
+        except sqlite3.OperationalError:
+            stored = None
+    if version != MANIFEST_VERSION or stored != params:
+        print("Manifest missing or outdated, rebuilding from all files")
+        conn.executescript('''
+            DROP TABLE IF EXISTS meta;
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS file_keys;
+            DROP TABLE IF EXISTS votes;
+        ''')
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT,
+            columns TEXT
+        );
+        CREATE TABLE IF NOT EXISTS file_keys (
+            path TEXT,
+            key TEXT,
+            matched INTEGER,
+            labels TEXT,
+            row TEXT,
+            sig BLOB,
+            PRIMARY KEY (path, key)
+        );
+        CREATE TABLE IF NOT EXISTS votes (
+            key TEXT PRIMARY KEY,
+            count INTEGER
+        );
+    ''')
+    conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('params', ?)", (params,))
+    conn.execute(f'PRAGMA user_version = {MANIFEST_VERSION}')
+    conn.commit()
+    return conn
+
+
+def canonical_flag(value):
+    """Spell a screening flag consistently: True/"TRUE"/"true" -> "True", blank -> ""."""
+    text = str(value).strip()
+    lowered = text.lower()
+    if lowered in ('true', '1', '1.0', 'yes'):
+        return 'True'
+    if lowered in ('false', '0', '0.0', 'no'):
+        return 'False'
+    return text
+
+
+def normalize_flag(value):
+    """Map a screening flag (True/"TRUE"/"false"/blank...) to 1.0, 0.0 or NaN."""
+    flag = canonical_flag(value)
+    if flag == 'True':
+        return 1.0
+    if flag == 'False':
+        return 0.0
+    return np.nan
+
+
+def read_header(file):
+    with open(file, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+def read_typed_csv(file, columns):
+    """
+    Read only `columns` of a stage-01 CSV, all as text with blanks kept as "".
+    Uses the multi-threaded pyarrow reader when available.
+    """
+    if pa_csv is not None:
+        table = pa_csv.read_csv(file, convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False))
+        return table.to_pandas()
+    return pd.read_csv(file, usecols=columns, dtype=str, keep_default_na=False)[columns]
+
+
+def shingles(text):
+    """Hashed word 3-gram shingles of a normalized text."""
+    words = re.sub(r'[^a-z0-9 ]+', ' ', text.lower()).split()
+    if len(words) < SHINGLE_SIZE:
+        grams = words
+    else:
+        grams = [' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return np.array(sorted({zlib.crc32(g.encode('utf-8')) for g in grams}), dtype=np.uint64) % MERSENNE_PRIME
+
+
+def minhash_signature(text):
+    """MinHash signature (NUM_PERM uint32 values) of a text, or None when it has no shingles."""
+    hashed = shingles(text)
+    if len(hashed) == 0:
+        return None
+    permuted = (np.outer(PERM_A, hashed) + PERM_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def find_duplicate_clusters(keys, signatures, threshold=0.8):
+    """
+    Group near-duplicate keys with MinHash/LSH blocking.
+    Only keys that share an LSH band bucket are compared, so the cost grows
+    with the number of candidate pairs instead of quadratically.
+    Returns a mapping key -> canonical key (the first key of its cluster).
+    """
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(keys) > 1:
+        sigs = np.vstack(signatures)
+        rows = NUM_PERM // LSH_BANDS
+        for band in range(LSH_BANDS):
+            chunk = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+            chunk = chunk.view(np.dtype((np.void, chunk.dtype.itemsize * rows))).ravel()
+            _, inverse, counts = np.unique(chunk, return_inverse=True, return_counts=True)
+            if counts.max() < 2:
+                continue
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.cumsum(counts)[:-1]
+            for bucket in np.split(order, bounds):
+                if len(bucket) < 2:
+                    continue
+                # verify candidates on the estimated Jaccard similarity, one row of pairs at a time
+                for k, i in enumerate(bucket[:-1]):
+                    others = bucket[k + 1:]
+                    similar = (sigs[others] == sigs[i]).mean(axis=1) >= threshold
+                    for j in others[similar]:
+                        root_i, root_j = find(i), find(j)
+                        if root_i != root_j:
+                            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return {key: keys[find(i)] for i, key in enumerate(keys)}
+
+
+def scan_screening_file(file, match_columns, match_value, fuzzy=False):
+    """
+    Read the light columns (key and flags) of one screening CSV.
+    Returns the file's column order, the de-duplicated keys, the flag matrix
+    and the mask of keys where all match_columns equal match_value.
+    With fuzzy=True the abstract is read too and MinHash signatures of the
+    matched rows are returned. Runs in a worker of the ingestion pool.
+    """
+    header = read_header(file)
+    columns = [KEY_COLUMN] + [c for c in match_columns if c != KEY_COLUMN]
+    if fuzzy and ABSTRACT_COLUMN in header and ABSTRACT_COLUMN not in columns:
+        columns.append(ABSTRACT_COLUMN)
+    pd_file = read_typed_csv(file, columns)
+    pd_file = pd_file[pd_file[KEY_COLUMN] != '']
+    pd_file = pd_file.drop_duplicates(subset=[KEY_COLUMN], keep='first')
+    flags = pd_file[match_columns].apply(lambda column: column.map(canonical_flag))
+    # include rows where all match_columns equal match_value
+    mask = (flags == canonical_flag(match_value)).all(axis=1).to_numpy()
+    labels = np.column_stack([flags[c].map(normalize_flag).to_numpy(dtype=float) for c in match_columns])
+    signatures = {}
+    if fuzzy:
+        matched = pd_file[mask]
+        abstracts = matched[ABSTRACT_COLUMN] if ABSTRACT_COLUMN in matched else [''] * len(matched)
+        for key, abstract in zip(matched[KEY_COLUMN], abstracts):
+            signature = minhash_signature(f"{key} {abstract}")
+            if signature is not None:
+                signatures[key] = signature.tobytes()
+    return {
+        'path': file,
+        'columns': header,
+        'keys': pd_file[KEY_COLUMN].tolist(),
+        'labels': labels,
+        'mask': mask,
+        'signatures': signatures,
+    }
+
+
+def load_rows(file, keys):
+    """Read every column of `file` for the given keys only (heavy text join)."""
+    columns = read_header(file)
+    pd_file = read_typed_csv(file, columns)
+    pd_file = pd_file.drop_duplicates(subset=[KEY_COLUMN], keep='first')
+    pd_file = pd_file[pd_file[KEY_COLUMN].isin(set(keys))]
+    return file, pd_file.to_dict(orient='records')
+
+
+def ingestion_pool(workers):
+    """pyarrow releases the GIL, so threads suffice; the pandas reader needs processes."""
+    return ThreadPoolExecutor(workers) if pa_csv is not None else ProcessPoolExecutor(workers)
+
+
+def run_parallel(function, jobs, workers):
+    """Run function(*job) for every job, in a pool when it is worth it."""
+    if workers <= 1 or len(jobs) <= 1:
+        return [function(*job) for job in jobs]
+    with ingestion_pool(min(workers, len(jobs))) as pool:
+        futures = [pool.submit(function, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def forget_file(conn, path):
+    """Remove the votes and rows a file contributed to the manifest."""
+    keys = [k for (k,) in conn.execute('SELECT key FROM file_keys WHERE path = ? AND matched = 1', (path,))]
+    conn.executemany('UPDATE votes SET count = count - 1 WHERE key = ?', [(k,) for k in keys])
+    conn.execute('DELETE FROM votes WHERE count <= 0')
+    conn.execute('DELETE FROM file_keys WHERE path = ?', (path,))
+    conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+
+def update_manifest(conn, files, match_columns, match_value, workers=1, fuzzy=False):
+    """
+    Bring the manifest in line with the files on disk.
+    Only new or changed files are parsed; unchanged files are recognized by
+    size and mtime, or by content hash when only the mtime moved.
+    Changed files are scanned in parallel, reading only the key and flag
+    columns. Returns the number of files that had to be parsed.
+    """
+    known = {path: (size, mtime, sha) for path, size, mtime, sha in
+             conn.execute('SELECT path, size, mtime, sha256 FROM files')}
+
+    # files that disappeared from the folder no longer vote
+    for path in set(known) - set(files):
+        print(f"Removed: {path}")
+        forget_file(conn, path)
+
+    changed = {}
+    for file in files:
+        stat = os.stat(file)
+        previous = known.get(file)
+        if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+            continue
+        sha = file_sha256(file)
+        if previous and previous[0] == stat.st_size and previous[2] == sha:
+            # touched but not modified
+            conn.execute('UPDATE files SET mtime = ? WHERE path = ?', (stat.st_mtime, file))
+            continue
+        print(file)
+        changed[file] = (stat, sha)
+
+    scans = run_parallel(scan_screening_file,
+                         [(file, match_columns, match_value, fuzzy) for file in changed], workers)
+
+    for scan in scans:
+        file = scan['path']
+        stat, sha = changed[file]
+        if file in known:
+            forget_file(conn, file)
+        # model flags of every row, kept for the agreement report
+        labels = [json.dumps([None if np.isnan(v) else v for v in row]) for row in scan['labels']]
+        conn.executemany(
+            'INSERT INTO file_keys (path, key, matched, labels, row, sig) VALUES (?, ?, ?, ?, NULL, ?)',
+            [(file, key, int(is_matched), label, scan['signatures'].get(key))
+             for key, is_matched, label in zip(scan['keys'], scan['mask'], labels)])
+        conn.executemany(
+            'INSERT INTO votes (key, count) VALUES (?, 1) '
+            'ON CONFLICT(key) DO UPDATE SET count = count + 1',
+            [(key,) for key, is_matched in zip(scan['keys'], scan['mask']) if is_matched])
+        conn.execute(
+            'INSERT INTO files (path, size, mtime, sha256, columns) VALUES (?, ?, ?, ?, ?)',
+            (file, stat.st_size, stat.st_mtime, sha, json.dumps(scan['columns'])))
+
+    conn.commit()
+    return len(scans)
+
+
+def duplicate_clusters(conn, files, threshold=0.8):
+    """Cluster the matched titles of all files by MinHash similarity of title and abstract."""
+    order = {path: i for i, path in enumerate(files)}
+    first_seen = {}
+    for path, key, sig in conn.execute('SELECT path, key, sig FROM file_keys WHERE matched = 1 AND sig IS NOT NULL'):
+        if key not in first_seen or order[path] < first_seen[key][0]:
+            first_seen[key] = (order[path], sig)
+    keys = sorted(first_seen, key=lambda k: (first_seen[k][0], k))
+    signatures = [np.frombuffer(first_seen[k][1], dtype=np.uint32) for k in keys]
+    return find_duplicate_clusters(keys, signatures, threshold)
+
+
+def build_merged(conn, files, threshold, workers=1, canonical=None):
+    """
+    Build the merged table from the stored votes: one row per key that reached the threshold.
+    With `canonical` (key -> cluster key from the fuzzy duplicate detector)
+    near-duplicate titles vote together, each file counting once per cluster,
+    and the cluster is reported in a DuplicateCluster column.
+    The heavy text columns are joined back here, for the winning rows only,
+    and cached in the manifest for the next run.
+    """
+    order = {path: i for i, path in enumerate(files)}
+
+    # union of the columns in file order, as pd.concat(sort=False) would give
+    columns = []
+    file_columns = dict(conn.execute('SELECT path, columns FROM files'))
+    for path in files:
+        for column in json.loads(file_columns.get(path, '[]')):
+            if column not in columns:
+                columns.append(column)
+
+    if canonical is None:
+        query = ('SELECT fk.path, fk.key, fk.row FROM file_keys fk '
+                 'JOIN votes v ON v.key = fk.key WHERE fk.matched = 1 AND v.count = ?')
+        candidates = list(conn.execute(query, (threshold,)))
+    else:
+        voters = {}
+        candidates = list(conn.execute('SELECT path, key, row FROM file_keys WHERE matched = 1'))
+        for path, key, _ in candidates:
+            voters.setdefault(canonical.get(key, key), set()).add(path)
+        candidates = [c for c in candidates if len(voters[canonical.get(c[1], c[1])]) == threshold]
+
+    # keep the row from the first file that voted for the key (or cluster)
+    winners = {}
+    for path, key, row in candidates:
+        cluster = canonical.get(key, key) if canonical is not None else key
+        rank = (order[path], key != cluster)
+        if cluster not in winners or rank < winners[cluster][0]:
+            winners[cluster] = (rank, path, key, row)
+
+    missing = {}
+    for cluster, (_, path, key, row) in winners.items():
+        if row is None:
+            missing.setdefault(path, []).append(key)
+    if missing:
+        loaded = {path: {r[KEY_COLUMN]: r for r in records}
+                  for path, records in run_parallel(load_rows, list(missing.items()), workers)}
+        for cluster, (rank, path, key, row) in list(winners.items()):
+            if row is None and key in loaded.get(path, {}):
+                row = json.dumps(loaded[path][key])
+                winners[cluster] = (rank, path, key, row)
+                conn.execute('UPDATE file_keys SET row = ? WHERE path = ? AND key = ?', (row, path, key))
+        conn.commit()
+
+    ordered = sorted(winners.items(), key=lambda item: item[1][0])
+    records = []
+    for cluster, (_, _, _, row) in ordered:
+        if row is None:
+            continue
+        record = json.loads(row)
+        if canonical is not None:
+            record['DuplicateCluster'] = cluster
+        records.append(record)
+    if canonical is not None:
+        columns = columns + ['DuplicateCluster']
+    return pd.DataFrame(records, columns=columns)
+
+
+def cohen_kappa(a, b):
+    """Cohen's kappa of two binary raters along the last axis (works on bootstrap stacks)."""
+    po = (a == b).mean(axis=-1)
+    pa = a.mean(axis=-1)
+    pb = b.mean(axis=-1)
+    pe = pa * pb + (1 - pa) * (1 - pb)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (po - pe) / (1 - pe)
+
+
+def fleiss_kappa(ones, n_raters):
+    """Fleiss' kappa for binary ratings; `ones` counts the raters voting 1 per item (last axis)."""
+    zeros = n_raters - ones
+    p_i = (ones * (ones - 1) + zeros * (zeros - 1)) / (n_raters * (n_raters - 1))
+    p_bar = p_i.mean(axis=-1)
+    p1 = ones.mean(axis=-1) / n_raters
+    pe = p1 ** 2 + (1 - p1) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (p_bar - pe) / (1 - pe)
+
+
+def bootstrap_ci(statistic, arrays, n_boot, rng, alpha=0.05, max_cells=2_000_000):
+    """
+    Percentile bootstrap interval over items. Resamples are drawn as index
+    matrices and evaluated in one vectorized call per chunk, with chunks
+    sized so that n_boot x n_items never has to be held at once.
+    """
+    n_items = len(arrays[0])
+    if n_boot <= 0 or n_items == 0:
+        return [None, None]
+    per_chunk = max(1, max_cells // n_items)
+    draws = []
+    for start in range(0, n_boot, per_chunk):
+        idx = rng.integers(0, n_items, size=(min(per_chunk, n_boot - start), n_items))
+        draws.append(statistic(*(x[idx] for x in arrays)))
+    draws = np.concatenate(draws)
+    if np.isnan(draws).all():
+        return [None, None]
+    low, high = np.nanpercentile(draws, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return [float(low), float(high)]
+
+
+def _as_float(value):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+def agreement_report(conn, files, match_columns, n_boot=1000, seed=0):
+    """
+    Inter-rater agreement of the screening flags stored in the manifest.
+    - Cohen's kappa for every pair of match_columns (e.g. Claude vs OpenAI),
+      pooled over all replicate files and per file.
+    - Fleiss' kappa per column across replicate files, on the titles every
+      file rated.
+    Bootstrap confidence intervals resample the rated items.
+    """
+    rng = np.random.default_rng(seed)
+    file_index = {path: i for i, path in enumerate(files)}
+    key_index = {}
+    cells = []
+    for path, key, labels in conn.execute('SELECT path, key, labels FROM file_keys'):
+        if path not in file_index:
+            continue
+        k = key_index.setdefault(key, len(key_index))
+        cells.append((file_index[path], k, json.loads(labels)))
+
+    # ratings[file, title, column], NaN where a file has no (valid) rating
+    ratings = np.full((len(files), len(key_index), len(match_columns)), np.nan)
+    if cells:
+        f_idx, k_idx, values = zip(*cells)
+        ratings[np.array(f_idx), np.array(k_idx)] = np.array(values, dtype=float)
+
+    report = {'files': len(files), 'titles': len(key_index), 'bootstrap': n_boot,
+              'cohen_kappa': [], 'fleiss_kappa': []}
+
+    for i in range(len(match_columns)):
+        for j in range(i + 1, len(match_columns)):
+            a = ratings[:, :, i]
+            b = ratings[:, :, j]
+            valid = ~np.isnan(a) & ~np.isnan(b)
+            pooled_a, pooled_b = a[valid], b[valid]
+            entry = {
+                'raters': [match_columns[i], match_columns[j]],
+                'n': int(valid.sum()),
+                'kappa': _as_float(cohen_kappa(pooled_a, pooled_b)) if valid.any() else None,
+                'ci95': bootstrap_ci(cohen_kappa, [pooled_a, pooled_b], n_boot, rng),
+                'per_file': {},
+            }
+            for path, f in file_index.items():
+                v = valid[f]
+                entry['per_file'][path] = _as_float(cohen_kappa(a[f][v], b[f][v])) if v.any() else None
+            report['cohen_kappa'].append(entry)
+
+    if len(files) >= 2:
+        for c, column in enumerate(match_columns):
+            per_title = ratings[:, :, c].T
+            complete = per_title[~np.isnan(per_title).any(axis=1)]
+            ones = complete.sum(axis=1)
+            n_raters = len(files)
+            statistic = lambda x: fleiss_kappa(x, n_raters)
+            report['fleiss_kappa'].append({
+                'column': column,
+                'replicates': n_raters,
+                'n': int(len(complete)),
+                'kappa': _as_float(statistic(ones)) if len(complete) else None,
+                'ci95': bootstrap_ci(statistic, [ones], n_boot, rng),
+            })
+    return report
+
+
+def print_agreement_report(report):
+    print(f"Agreement over {report['titles']} titles in {report['files']} file(s):")
+    fmt = lambda x: 'n/a' if x is None else f"{x:.3f}"
+    for entry in report['cohen_kappa']:
+        low, high = entry['ci95']
+        print(f"  Cohen's kappa {entry['raters'][0]} vs {entry['raters'][1]}: "
+              f"{fmt(entry['kappa'])} (95% CI {fmt(low)}-{fmt(high)}, n={entry['n']})")
+    for entry in report['fleiss_kappa']:
+        low, high = entry['ci95']
+        print(f"  Fleiss' kappa {entry['column']} across {entry['replicates']} replicates: "
+              f"{fmt(entry['kappa'])} (95% CI {fmt(low)}-{fmt(high)}, n={entry['n']})")
 
 
 def main():
@@ -10,36 +559,56 @@ def main():
     parser.add_argument('--threshold', type=int, default=3, help='Threshold for number of matches to consider')
     parser.add_argument('--match_columns', type=str, nargs='+', default=['ClaudiaIsRelated', 'OpenAIIsRelated'], help='Columns to consider for matching (default: ClaudiaIsRelated OpenAIIsRelated)')
     parser.add_argument('--match_value', type=str, default='True', help='Value to match in all columns (default: True)')
+    parser.add_argument('--manifest', type=str, default=None, help='Manifest database used for incremental merges (default: <folder>/merge_manifest.db)')
+    parser.add_argument('--full_rebuild', action='store_true', help='Ignore the manifest and re-read every CSV file')
+    parser.add_argument('--output', type=str, default='merged_output.csv', help='Merged CSV output path')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel CSV readers (default: CPU count)')
+    parser.add_argument('--report', type=str, default='agreement_report.json', help='Inter-rater agreement report path (empty to skip)')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Bootstrap resamples for the agreement confidence intervals')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the bootstrap')
+    parser.add_argument('--fuzzy_dedup', action='store_true', help='Merge near-duplicate titles (MinHash/LSH on title and abstract) before the consensus vote')
+    parser.add_argument('--dedup_threshold', type=float, default=0.8, help='Estimated Jaccard similarity above which two articles are duplicates (default: 0.8)')
     args = parser.parse_args()
 
     dir_path = args.folder
     threshold = args.threshold
     match_columns = args.match_columns
     match_value = args.match_value
+    manifest_path = args.manifest or os.path.join(dir_path, 'merge_manifest.db')
 
-    files = os.listdir(dir_path)
+    files = sorted(os.listdir(dir_path))
     files = [f"{dir_path}/{file}" for file in files if file.endswith('.csv')]
 
-    pd_data = []
-    for file in files:
-        print(file)
-        pd_file = pd.read_csv(file)
-        pd_file = pd_file.drop_duplicates(subset=['Title'], keep='first')
-        pd_data.append(pd_file)
+    if args.full_rebuild and os.path.exists(manifest_path):
+        os.remove(manifest_path)
 
-    pd_data_B = pd.concat(pd_data, ignore_index=True, sort=False)
+    conn = open_manifest(manifest_path, match_columns, match_value, fuzzy=args.fuzzy_dedup)
+    try:
+        parsed = update_manifest(conn, files, match_columns, match_value, workers=args.workers,
+                                 fuzzy=args.fuzzy_dedup)
+        print(f"Parsed {parsed} new or changed file(s), {len(files) - parsed} reused from manifest")
 
-    # include rows where all match_columns equal match_value
-    mask = (pd_data_B[match_columns] == match_value).all(axis=1)
-    pd_data_B = pd_data_B[mask]
+        total = conn.execute('SELECT COUNT(*) FROM file_keys WHERE matched = 1').fetchone()[0]
+        print(f"Total matched rows: {total}")
+        canonical = None
+        if args.fuzzy_dedup:
+            canonical = duplicate_clusters(conn, files, args.dedup_threshold)
+            merged_titles = sum(1 for key, cluster in canonical.items() if key != cluster)
+            print(f"Near-duplicate titles merged into other clusters: {merged_titles}")
+        # filter by threshold
+        pd_data_C = build_merged(conn, files, threshold, workers=args.workers, canonical=canonical)
 
-    print(f"Total matched rows: {len(pd_data_B)}")
-    # filter by threshold
-    pd_data_C = pd_data_B.groupby('Title').filter(lambda x: len(x) == threshold)
-    pd_data_C = pd_data_C.drop_duplicates(subset=['Title'], keep='first')
+        if args.report:
+            report = agreement_report(conn, files, match_columns, n_boot=args.bootstrap, seed=args.seed)
+            print_agreement_report(report)
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Agreement report saved as '{args.report}'")
+    finally:
+        conn.close()
 
-    pd_data_C.to_csv('merged_output.csv', index=False)
-    print("Merged CSV file saved as 'merged_output.csv'")
+    pd_data_C.to_csv(args.output, index=False)
+    print(f"Merged CSV file saved as '{args.output}'")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
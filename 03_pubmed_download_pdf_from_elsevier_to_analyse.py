@@ -1,101 +1,577 @@
 # %%
-import requests
-from tqdm import tqdm
-import pandas as pd
-import time
-import re
-import requests
-from bs4 import BeautifulSoup
-import time
+"""
+Stage 03: download the PDFs of the included articles.
+
+Importing this module has no side effects; run it as a script or call
+main(). Selenium, undetected-chromedriver, Playwright, BeautifulSoup, pandas
+and aiohttp are only imported by the resolver tiers that need them.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import hashlib
+import json
 import os
+import queue
 import re
+import shutil
+import sqlite3
+import threading
+import time
 import traceback
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen, urlretrieve
 
-from urllib.parse import urljoin
+import requests
+from tqdm import tqdm
+
+from id_converter import IdCache, resolve_ids
+from oa_index import OAIndex
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # not on Linux or not installed: poll the directory instead
+    INotify = None
 
-import argparse
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description="Download PubMed PDFs from Elsevier")
     parser.add_argument('--output_folder', type=str, default='./pubmed_pdfs/', help='Folder to store downloaded PDFs')
     parser.add_argument('--csv_file', type=str, default='pubmed_create_csv_file_to_in_depth_analyse.csv', help='CSV file with PMIDs')
-    return parser.parse_args()
+    parser.add_argument('--id_cache', type=str, default='id_cache.db', help='Shared PMID -> PMCID/DOI cache (see id_converter.py)')
+    parser.add_argument('--oa_index', type=str, default='oa_index.db', help='Local PMC OA file-list index (see oa_index.py)')
+    parser.add_argument('--refresh_oa_index', action='store_true', help='Download the PMC OA file list and rebuild the local index first')
+    parser.add_argument('--ledger', type=str, default=None, help='Download ledger database (default: <output_folder>/download_ledger.db)')
+    parser.add_argument('--max_attempts', type=int, default=3, help='Runs after which a failing article is left for manual retrieval')
+    parser.add_argument('--retry_passes', type=int, default=1, help='Extra browser passes over the articles that failed in this run')
+    parser.add_argument('--interactive', action='store_true', help='At the end, offer to open a browser for each article needing manual retrieval')
+    parser.add_argument('--selector_cache', type=str, default=None, help='Per-host PDF link selector cache (default: <output_folder>/selector_cache.db)')
+    parser.add_argument('--http_workers', type=int, default=4, help='Articles resolved concurrently by the HTTP tiers')
+    parser.add_argument('--per_host', type=int, default=2, help='Maximum concurrent requests to one host')
+    parser.add_argument('--host_interval', type=float, default=1.0, help='Minimum seconds between two requests to the same host')
+    parser.add_argument('--recycle_every', type=int, default=50, help='Restart the shared browser after this many articles')
+    parser.add_argument('--engine', type=str, choices=['selenium', 'playwright'], default='selenium', help='Browser engine: one undetected Chrome (selenium) or parallel headless Playwright contexts')
+    parser.add_argument('--workers', type=int, default=4, help='Parallel browser contexts for the playwright engine')
+    parser.add_argument('--headed', action='store_true', help='Show the Playwright browsers instead of running headless')
+    parser.add_argument('--start_timeout', type=float, default=10, help='Seconds to wait for a browser download to start')
+    parser.add_argument('--download_timeout', type=float, default=300, help='Maximum seconds for a browser download to complete')
+    parser.add_argument('--stall_timeout', type=float, default=30, help='Give up on a browser download that has not grown for this many seconds')
+    return parser.parse_args(argv)
 
-args = get_args()
-TO_STORE = args.output_folder
-filename = args.csv_file
+
+# Output folder and browser download timeouts; main() sets them from the command line
+TO_STORE = './pubmed_pdfs/'
+START_TIMEOUT = 10
+DOWNLOAD_TIMEOUT = 300
+STALL_TIMEOUT = 30
+SELECTOR_CACHE = None
+OA_INDEX = None
+
+# Where the chromedriver matching the installed Chrome is remembered between runs
+CHROMEDRIVER_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'pubmed_pdfs', 'chromedriver.json')
+_chromedriver_path = None
 
 
 # Function to ensure the directory exists
 def ensure_directory_exists(directory):
-    import os
     if not os.path.exists(directory):
         os.makedirs(directory)
 
 
-from bs4 import BeautifulSoup
-import requests
-import os
+def parse_html(markup):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup, 'html.parser')
 
-from playwright.sync_api import sync_playwright
-import os
 
-import requests
-import os
-import xml.etree.ElementTree as ET
-import time
-import glob
-import requests
-import os
-import xml.etree.ElementTree as ET
+def ensure_chromedriver():
+    """
+    Install the chromedriver for the local Chrome once. The version check of
+    chromedriver_autoinstaller goes over the network, so the installed path
+    is cached per Chrome version and reused by later calls and runs.
+    """
+    global _chromedriver_path
+    if _chromedriver_path:
+        return _chromedriver_path
+    import chromedriver_autoinstaller
+    chrome_version = chromedriver_autoinstaller.get_chrome_version()
+    try:
+        with open(CHROMEDRIVER_CACHE, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    path = cached.get('path')
+    if cached.get('chrome_version') != chrome_version or not path or not os.path.exists(path):
+        path = chromedriver_autoinstaller.install()
+        os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE), exist_ok=True)
+        with open(CHROMEDRIVER_CACHE, 'w', encoding='utf-8') as f:
+            json.dump({'chrome_version': chrome_version, 'path': path}, f)
+    driver_dir = os.path.dirname(path)
+    if driver_dir not in os.environ.get('PATH', '').split(os.pathsep):
+        os.environ['PATH'] = driver_dir + os.pathsep + os.environ.get('PATH', '')
+    _chromedriver_path = path
+    return path
 
-from urllib.request import urlretrieve
-from urllib.parse import urlparse
 
-def get_url(pmc_id):
-    import requests
-from bs4 import BeautifulSoup
-import os
+# Suffixes browsers use for downloads that are still being written
+PARTIAL_DOWNLOAD_SUFFIXES = ('.crdownload', '.part', '.partial', '.download', '.tmp')
+
+# CSS selectors tried in order to find the full-text / PDF link of an article
+PDF_LINK_SELECTORS = [
+    'a[data-ga-category="full_text"]',
+    'a[href*=".pdf"]',
+    'a[href*=".pdf"].pdf-download',
+    'a.pdf-download',
+    'a.c-Button.pdf-download',
+    'a.c-Button--primary.pdf-download',
+    'a[title*="Download PDF"][href*=".pdf"]',
+    'a[href^="pdf/"][aria-label="Download PDF"]',
+    'a[aria-label*="Download"]',
+    'a[aria-label*="view"]',
+    'a.int-view.pdf-link',
+    'a img[alt*="full text link"]',
+    'a[title*="full text"]',
+    'a[title*="ePDF"]',  # <--- Add this for extra robustness
+    'a[href*="/epdf/"]'            ]
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import ElementNotInteractableException
-from selenium.webdriver.support import expected_conditions as EC
-import time
-import os
 
-import chromedriver_autoinstaller
-chromedriver_autoinstaller.install()
+class SelectorCache:
+    """
+    Per-host record of which PDF_LINK_SELECTORS entry led to a valid PDF,
+    separately for the article page ('landing') and the publisher page
+    ('pdf'). Known winners for a host are tried first, so daily publishers
+    resolve in one lookup instead of a scan of the whole list.
+    """
 
-# Set up Chrome options
+    def __init__(self, path):
+        self.lock = threading.Lock()  # shared by the Playwright worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS selector_hits (
+                host TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                selector TEXT NOT NULL,
+                successes INTEGER NOT NULL DEFAULT 0,
+                last_success TEXT,
+                PRIMARY KEY (host, stage, selector)
+            )
+        ''')
+        self.conn.commit()
 
-import undetected_chromedriver as uc
+    def ordered(self, url, stage):
+        """PDF_LINK_SELECTORS with this host's past winners moved to the front."""
+        with self.lock:
+            winners = [selector for (selector,) in self.conn.execute(
+                "SELECT selector FROM selector_hits WHERE host = ? AND stage = ? "
+                "ORDER BY successes DESC, last_success DESC", (_host(url), stage))]
+        winners = [selector for selector in winners if selector in PDF_LINK_SELECTORS]
+        return winners + [selector for selector in PDF_LINK_SELECTORS if selector not in winners]
 
-def download_pdf_with_selenium(pmc_id):
-    if os.path.exists(os.path.join(TO_STORE, f"{pmc_id}.pdf")):
-        print(f"PDF for PMC ID {pmc_id} already exists. Skipping download.")
+    def record(self, url, stage, selector):
+        if not url or not selector:
+            return
+        with self.lock:
+            self.conn.execute('''
+                INSERT INTO selector_hits (host, stage, selector, successes, last_success)
+                VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT(host, stage, selector) DO UPDATE SET
+                    successes = successes + 1, last_success = CURRENT_TIMESTAMP
+            ''', (_host(url), stage, selector))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _host(url):
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+# Titles of bot-wall / challenge pages served with a 200 status
+CHALLENGE_TITLES = ('just a moment', 'attention required', 'access denied', 'are you a robot',
+                    'verify you are human', 'security check', 'bot verification', 'ddos-guard')
+# Body text of challenge pages; only checked on short pages, since normal publisher pages
+# also load the Cloudflare JS-detection script or reCAPTCHA
+CHALLENGE_MARKERS = ('cf-browser-verification', 'challenge-platform', 'captcha', 'are you a robot',
+                     'unusual traffic')
+CHALLENGE_MAX_BODY = 20000
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def looks_like_challenge(text=None, headers=None, title=None):
+    """Whether a page answered with a success status is a bot challenge: header, page title or a short body."""
+    if headers is not None and (headers.get('cf-mitigated') or '').lower() == 'challenge':
         return True
-    """Download PDF using Selenium with better wait times and error handling"""
-    article_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmc_id}"# f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/"
-    print(f"Accessing article page with Selenium: {article_url}")
-    driver = None
+    if title is None and text:
+        match = TITLE_PATTERN.search(text[:CHALLENGE_MAX_BODY])
+        title = match.group(1) if match else ''
+    if title and any(marker in title.strip().lower() for marker in CHALLENGE_TITLES):
+        return True
+    if text and len(text) < CHALLENGE_MAX_BODY:
+        text = text.lower()
+        return any(marker in text for marker in CHALLENGE_MARKERS)
+    return False
+
+
+class HostScheduler:
+    """
+    Politeness per host for concurrent downloads: at most `max_per_host`
+    requests in flight, at least `min_interval` seconds between two request
+    starts, and a spacing that doubles (up to `max_interval`) whenever the
+    host answers 403/429/503 or a challenge page, then relaxes again on success.
+    """
+
+    def __init__(self, max_per_host=2, min_interval=1.0, max_interval=60.0):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.condition = threading.Condition()
+        self.active = {}
+        self.next_start = {}
+        self.interval = {}
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        """Hold one request slot for the host of `url`, waiting for its turn."""
+        host = _host(url)
+        with self.condition:
+            while True:
+                wait = self.next_start.get(host, 0) - time.monotonic()
+                if self.active.get(host, 0) < self.max_per_host and wait <= 0:
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.next_start[host] = time.monotonic() + self.interval.get(host, self.min_interval)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active[host] -= 1
+                self.condition.notify_all()
+
+    def report(self, url, status=None, text=None, headers=None, title=None):
+        """Adapt the host's spacing to its last answer; False when it was a refusal or a challenge."""
+        host = _host(url)
+        blocked = status in (403, 429, 503) or looks_like_challenge(text, headers, title)
+        with self.condition:
+            interval = self.interval.get(host, self.min_interval)
+            if blocked:
+                interval = min(max(interval, self.min_interval) * 2, self.max_interval)
+                print(f"{host} is pushing back (status {status}), spacing its requests {interval:.1f}s apart")
+            else:
+                interval = max(self.min_interval, interval * 0.75)
+            self.interval[host] = interval
+            self.next_start[host] = max(self.next_start.get(host, 0), time.monotonic() + interval)
+        return not blocked
+
+
+SCHEDULER = HostScheduler()
+
+
+def polite_get(session, url, **kwargs):
+    """GET through the host scheduler; `session` is a requests.Session or the requests module."""
+    with SCHEDULER.slot(url):
+        response = session.get(url, **kwargs)
+    # a streamed body is not read here; callers check its text with looks_like_challenge
+    SCHEDULER.report(response.url, response.status_code,
+                     None if kwargs.get('stream') else response.text, response.headers)
+    return response
+
+
+def publisher_key(article):
+    """Rough publisher of an article before any request: its DOI registrant, else PMC."""
+    if article.get('doi'):
+        return article['doi'].split('/')[0]
+    return 'pmc' if article.get('pmc') else 'pubmed'
+
+
+def interleave_by_publisher(articles):
+    """Round-robin the articles across publishers so no single host gets a burst."""
+    groups = {}
+    for article in articles:
+        groups.setdefault(publisher_key(article), []).append(article)
+    queues = list(groups.values())
+    interleaved = []
+    while queues:
+        for group in queues:
+            interleaved.append(group.pop(0))
+        queues = [group for group in queues if group]
+    return interleaved
+
+
+def ordered_selectors(url, stage):
+    return SELECTOR_CACHE.ordered(url, stage) if SELECTOR_CACHE else PDF_LINK_SELECTORS
+
+
+def remember_selectors(article_url, landing_selector, publisher_url, pdf_selector):
+    """Credit the selectors of a download that produced a valid PDF."""
+    if SELECTOR_CACHE:
+        SELECTOR_CACHE.record(article_url, 'landing', landing_selector)
+        SELECTOR_CACHE.record(publisher_url, 'pdf', pdf_selector)
+
+
+def worker_download_dir(name):
+    """Private download directory of one browser, so files can be attributed to their PMID."""
+    directory = os.path.abspath(os.path.join(TO_STORE, '.downloads', name))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def clear_directory(directory):
+    for entry in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, entry))
+        except OSError:
+            pass
+
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-\d+/(\d+|\*)')
+
+
+def discard_partial(output_path):
+    """Remove the `.part` file of an interrupted transfer and its source record."""
+    for path in (f"{output_path}.part", f"{output_path}.part.json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def resumable_offset(url, output_path):
+    """
+    Bytes of `<output_path>.part` that can be resumed from `url`, with the
+    validator to send as If-Range. A partial file written from another URL,
+    or without an ETag/Last-Modified to check it against, is discarded.
+    """
+    partial = f"{output_path}.part"
+    if not os.path.exists(partial):
+        return 0, None
+    try:
+        with open(f"{partial}.json") as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        source = {}
+    validator = source.get('etag') or source.get('last_modified')
+    if source.get('url') != url or not validator or not os.path.getsize(partial):
+        discard_partial(output_path)
+        return 0, None
+    return os.path.getsize(partial), source
+
+
+async def stream_pdf_async(url, output_path, headers=None, cookies=None, session=None,
+                           chunk_size=64 * 1024, retries=3, timeout=60):
+    """
+    Stream a PDF to `output_path` without holding it in memory.
+    Data goes to `<output_path>.part`, with the source URL and its
+    ETag/Last-Modified in `<output_path>.part.json`. After a network error the
+    transfer is resumed with a Range/If-Range request, but only from the same
+    URL and only when the server answers 206 from the expected offset;
+    otherwise it starts over. The first bytes must be the %PDF magic, so HTML
+    error or login pages are aborted right away. The finished file is renamed
+    into place atomically.
+    """
+    import aiohttp
+    partial = f"{output_path}.part"
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout))
+    try:
+        for attempt in range(1, retries + 1):
+            offset, source = resumable_offset(url, output_path)
+            request_headers = dict(headers or {})
+            if offset:
+                request_headers['Range'] = f"bytes={offset}-"
+                request_headers['If-Range'] = source.get('etag') or source['last_modified']
+            try:
+                async with session.get(url, headers=request_headers, cookies=cookies, allow_redirects=True) as response:
+                    SCHEDULER.report(url, response.status, headers=response.headers)
+                    if response.status == 416 and offset:
+                        # the partial file does not match the resource any more
+                        print("Server rejected the resume range, restarting the transfer")
+                        discard_partial(output_path)
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+                    if response.status >= 500:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason)
+                    if response.status not in (200, 206):
+                        print(f"Failed to download the PDF. Status code: {response.status}")
+                        return False
+                    if offset and response.status == 200:
+                        # If-Range did not match or the Range header was ignored: this is the whole file
+                        print("Server did not resume the transfer, restarting it")
+                        offset = 0
+                    elif offset:
+                        match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                        if (not match or int(match.group(1)) != offset
+                                or (source.get('length') and match.group(2) not in ('*', str(source['length'])))):
+                            print("Server answered with an unexpected range, restarting the transfer")
+                            discard_partial(output_path)
+                            continue
+                    if not offset:
+                        discard_partial(output_path)
+                        with open(f"{partial}.json", 'w') as f:
+                            json.dump({'url': url,
+                                       'etag': response.headers.get('ETag'),
+                                       'last_modified': response.headers.get('Last-Modified'),
+                                       'length': response.content_length}, f)
+
+                    head = b''
+                    with open(partial, 'ab' if offset else 'wb') as f:
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            if offset == 0 and len(head) < 4:
+                                head += chunk[:4 - len(head)]
+                                if len(head) >= 4 and head != b'%PDF':
+                                    print(f"The response doesn't appear to be a PDF. Content-Type: {response.headers.get('Content-Type', '')}")
+                                    f.close()
+                                    discard_partial(output_path)
+                                    return False
+                            f.write(chunk)
+                    if offset == 0 and head != b'%PDF':
+                        print("The response doesn't appear to be a PDF.")
+                        discard_partial(output_path)
+                        return False
+                os.replace(partial, output_path)
+                discard_partial(output_path)
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Download interrupted ({e}), attempt {attempt}/{retries}")
+                if attempt < retries:
+                    await asyncio.sleep(2 ** attempt)
+        return False
+    finally:
+        if own_session:
+            await session.close()
+
+
+# One event loop and aiohttp session per worker thread, reused for every file it streams
+_stream_sessions = {}
+_stream_sessions_lock = threading.Lock()
+
+
+def _thread_stream_session(timeout=60):
+    """(loop, session) of the calling thread, created on its first download."""
+    key = threading.get_ident()
+    with _stream_sessions_lock:
+        state = _stream_sessions.get(key)
+    if state is None:
+        import aiohttp
+
+        async def open_session():
+            return aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout))
+
+        loop = asyncio.new_event_loop()
+        state = (loop, loop.run_until_complete(open_session()))
+        with _stream_sessions_lock:
+            _stream_sessions[key] = state
+    return state
+
 
-    # Configure browser options
-    # 
+def close_stream_sessions():
+    """Close the per-thread sessions and loops once the downloads are over."""
+    with _stream_sessions_lock:
+        states = list(_stream_sessions.values())
+        _stream_sessions.clear()
+    for loop, session in states:
+        loop.run_until_complete(session.close())
+        loop.close()
+
+
+def stream_pdf(url, output_path, headers=None, cookies=None, **kwargs):
+    """Synchronous wrapper around stream_pdf_async for the resolver tiers, on the thread's shared session."""
+    loop, session = _thread_stream_session()
+    with SCHEDULER.slot(url):
+        return loop.run_until_complete(stream_pdf_async(url, output_path, headers=headers, cookies=cookies,
+                                                        session=session, **kwargs))
+
+
+def wait_for_download(directory, start_timeout=None, timeout=None, stall_timeout=None, poll_interval=0.25):
+    """
+    Wait until a browser download in `directory` has finished and return its path.
+    Returns None when no download starts within start_timeout, when the total
+    time exceeds timeout, or when a partial file stops growing for stall_timeout.
+    Uses inotify events when available and polling otherwise.
+    """
+    start_timeout = START_TIMEOUT if start_timeout is None else start_timeout
+    timeout = DOWNLOAD_TIMEOUT if timeout is None else timeout
+    stall_timeout = STALL_TIMEOUT if stall_timeout is None else stall_timeout
+
+    watcher = None
+    if INotify is not None:
+        watcher = INotify()
+        watcher.add_watch(directory, inotify_flags.CREATE | inotify_flags.MODIFY |
+                          inotify_flags.MOVED_TO | inotify_flags.CLOSE_WRITE)
     try:
+        started = time.monotonic()
+        last_size = -1
+        last_growth = started
+        seen_any = False
+        while True:
+            now = time.monotonic()
+            entries = [e for e in os.listdir(directory) if not e.startswith('.')]
+            partial = [e for e in entries if e.lower().endswith(PARTIAL_DOWNLOAD_SUFFIXES)]
+            complete = [e for e in entries if e not in partial]
+            size = sum(os.path.getsize(os.path.join(directory, e)) for e in entries
+                       if os.path.exists(os.path.join(directory, e)))
+            if entries:
+                seen_any = True
+            if size != last_size:
+                last_size = size
+                last_growth = now
+            elif complete and not partial:
+                # finished and its size held for one interval
+                return max((os.path.join(directory, e) for e in complete), key=os.path.getctime)
+
+            if not seen_any and now - started > start_timeout:
+                print("No download started.")
+                return None
+            if seen_any and now - last_growth > stall_timeout:
+                print(f"Download stalled for {stall_timeout:.0f}s.")
+                return None
+            if now - started > timeout:
+                print(f"Download did not finish within {timeout:.0f}s.")
+                return None
+
+            if watcher is not None:
+                watcher.read(timeout=int(poll_interval * 1000))
+            else:
+                time.sleep(poll_interval)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+class BrowserSession:
+    """
+    A long-lived undetected Chrome shared by all articles of a run.
+    Between articles the browser is only cleaned up (extra tabs closed, blank
+    page); it is recycled after a browser error or every `recycle_every`
+    articles instead of being started and quit for each PMID.
+    """
+
+    def __init__(self, download_dir, recycle_every=50):
+        self.download_dir = os.path.abspath(download_dir)
+        os.makedirs(self.download_dir, exist_ok=True)
+        clear_directory(self.download_dir)
+        self.recycle_every = recycle_every
+        self.driver = None
+        self.articles = 0
+
+    def _launch(self):
+        import undetected_chromedriver as uc
+        # Configure browser options
         options = uc.ChromeOptions()
         options.add_argument('--no-first-run --no-service-autorun --password-store=basic')
         options.add_argument('--start-maximized')
         options.add_argument('--disable-blink-features=AutomationControlled')
-    
+
         options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.7151.69 Safari/537.36")
 
         # Set up download preferences
-        download_dir = os.path.abspath(TO_STORE)
         prefs = {
-            "download.default_directory": download_dir,
+            "download.default_directory": self.download_dir,
             "plugins.always_open_pdf_externally": True,  # Download PDFs instead of opening them
             "download.prompt_for_download": False,
             "download.directory_upgrade": True,
@@ -107,195 +583,367 @@ def download_pdf_with_selenium(pmc_id):
 
         # Set an implicit wait for all elements
         driver.implicitly_wait(10)
-        
-        # Navigate to the page
-        driver.get(article_url)
-        driver.implicitly_wait(10)
-        # Instead of clicking directly, try to get the URL from the href attribute
+        return driver
+
+    def get_driver(self):
+        """Return the running browser, starting one if needed."""
+        if self.driver is None:
+            print("Starting browser session...")
+            self.driver = self._launch()
+            self.articles = 0
+        return self.driver
+
+    def cleanup(self):
+        """Reset the browser between articles without restarting it."""
+        clear_directory(self.download_dir)
+        if self.driver is None:
+            return
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+        self.driver.get("about:blank")
+
+    def finish_article(self, healthy=True):
+        """Clean up after an article, recycling the browser when it misbehaved or is due."""
+        self.articles += 1
+        if not healthy or self.articles >= self.recycle_every:
+            print("Recycling browser session...")
+            self.close()
+            return
         try:
-            # Try multiple selectors to find the PDF link
-            selectors = [
-                'a[data-ga-category="full_text"]',
-                'a[href*=".pdf"]',
-                'a[href*=".pdf"].pdf-download',
-                'a.pdf-download',
-                'a.c-Button.pdf-download',
-                'a.c-Button--primary.pdf-download',
-                'a[title*="Download PDF"][href*=".pdf"]',
-                'a[href^="pdf/"][aria-label="Download PDF"]',
-                'a[aria-label*="Download"]',
-                'a[aria-label*="view"]',
-                'a.int-view.pdf-link',
-                'a img[alt*="full text link"]',
-                'a[title*="full text"]',
-                'a[title*="ePDF"]',  # <--- Add this for extra robustness
-                'a[href*="/epdf/"]'            ]
-
-            print("PMID", pmc_id)
-            pdf_link_element = None
-            for selector in selectors:
-                # print(f"Trying selector: {selector}")
-                elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                # print(f"Found {len(elements)} elements with selector: {selector}")
-                if elements:
-                    pdf_link_element = elements[0]
-                    # print(f"Found PDF link element using selector: {selector}")
-                    break
-            print(f"Final PDF link element: {pdf_link_element.get_attribute('href') if pdf_link_element else 'None'}")
+            self.cleanup()
+        except Exception as e:
+            print(f"Browser cleanup failed, recycling: {e}")
+            self.close()
 
-            
-            if not pdf_link_element:
-                return False
-            
-            # Get the href attribute value (the PDF URL)
-            pdf_url = pdf_link_element.get_attribute('href')
-            
-            if not pdf_url:
-                print("Could not extract PDF URL from the element.")
-                return False
-            
-            # print(f"Extracted PDF URL: {pdf_url}")
-            # Instead of clicking, navigate directly to the PDF URL
-            print(f"Navigating to the page URL {pdf_url}")
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+
+
+def download_pdf_with_selenium(pmc_id, session=None):
+    """Download PDF using Selenium with better wait times and error handling"""
+    if os.path.exists(os.path.join(TO_STORE, f"{pmc_id}.pdf")):
+        print(f"PDF for PMC ID {pmc_id} already exists. Skipping download.")
+        return True
+    article_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmc_id}"# f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/"
+    print(f"Accessing article page with Selenium: {article_url}")
+
+    # Without a shared session, fall back to a one-off browser for this article
+    own_session = session is None
+    if own_session:
+        session = BrowserSession(worker_download_dir('selenium'), recycle_every=1)
+    healthy = True
+    try:
+        driver = session.get_driver()
+        return _download_pdf_with_driver(driver, pmc_id, article_url, session.download_dir)
+    except Exception as e:
+        healthy = False
+        print(f"An error occurred in Selenium method: {str(e)}")
+        traceback.print_exc()  # Print full traceback for debugging
+        return False
+    finally:
+        if own_session:
+            session.close()
+        else:
+            session.finish_article(healthy)
+
+
+def _download_pdf_with_driver(driver, pmc_id, article_url, download_dir):
+    from selenium.webdriver.common.by import By
+    from selenium.common.exceptions import ElementNotInteractableException
+    # Navigate to the page
+    with SCHEDULER.slot(article_url):
+        driver.get(article_url)
+    driver.implicitly_wait(10)
+    # Instead of clicking directly, try to get the URL from the href attribute
+    try:
+        # Try multiple selectors to find the PDF link, this host's known winner first
+        print("PMID", pmc_id)
+        pdf_link_element = None
+        landing_selector = None
+        for selector in ordered_selectors(article_url, 'landing'):
+            # print(f"Trying selector: {selector}")
+            elements = driver.find_elements(By.CSS_SELECTOR, selector)
+            # print(f"Found {len(elements)} elements with selector: {selector}")
+            if elements:
+                pdf_link_element = elements[0]
+                landing_selector = selector
+                # print(f"Found PDF link element using selector: {selector}")
+                break
+        print(f"Final PDF link element: {pdf_link_element.get_attribute('href') if pdf_link_element else 'None'}")
+
+        
+        if not pdf_link_element:
+            return False
+        
+        # Get the href attribute value (the PDF URL)
+        pdf_url = pdf_link_element.get_attribute('href')
+        
+        if not pdf_url:
+            print("Could not extract PDF URL from the element.")
+            return False
+        
+        # print(f"Extracted PDF URL: {pdf_url}")
+        # Instead of clicking, navigate directly to the PDF URL
+        print(f"Navigating to the page URL {pdf_url}")
+        with SCHEDULER.slot(pdf_url):
             driver.get(pdf_url)
+        publisher_url = driver.current_url
+        if not SCHEDULER.report(publisher_url, title=driver.title):
+            return False
 
-            # When you find elements, always get the href:
-            pdf_link_element = None
-            for selector in selectors:
-                elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                # print(f"Found {len(elements)} elements with selector: {selector}")
-                if elements:
-                    for el in elements:
-                        href = el.get_attribute('href')
-                        # Exclude author-document.pdf links
-                        if href and '.pdf' in href and 'author-document' not in href.lower():
-                            pdf_link_element = el
-                            break
-                    if pdf_link_element:
+        # When you find elements, always get the href:
+        pdf_link_element = None
+        pdf_selector = None
+        for selector in ordered_selectors(publisher_url, 'pdf'):
+            elements = driver.find_elements(By.CSS_SELECTOR, selector)
+            # print(f"Found {len(elements)} elements with selector: {selector}")
+            if elements:
+                for el in elements:
+                    href = el.get_attribute('href')
+                    # Exclude author-document.pdf links
+                    if href and '.pdf' in href and 'author-document' not in href.lower():
+                        pdf_link_element = el
+                        pdf_selector = selector
                         break
-            pdf_url = pdf_link_element.get_attribute('href') if pdf_link_element else None
-            if pdf_url is None:
-                print("Could not find a valid PDF URL in the page.")
-                return False
-            print(f"Extracted PDF URL: {pdf_url}")
-            # download the PDF using Selenium
-            print("Navigating to the PDF URL...")
-            # Navigate to the PDF URL directly
+                if pdf_link_element:
+                    break
+        pdf_url = pdf_link_element.get_attribute('href') if pdf_link_element else None
+        if pdf_url is None:
+            print("Could not find a valid PDF URL in the page.")
+            return False
+        print(f"Extracted PDF URL: {pdf_url}")
+        # download the PDF using Selenium
+        print("Navigating to the PDF URL...")
+        # Navigate to the PDF URL directly
+        with SCHEDULER.slot(pdf_url):
             driver.get(pdf_url)
 
-            # Add a longer sleep time to wait for the PDF to load
-            print("Waiting for PDF to load...")
-            time.sleep(10)  # Wait 15 seconds
-            # Find the most recent PDF in the download directory
-            list_of_files = glob.glob(os.path.join(download_dir, '*.pdf'))
-            if list_of_files:
-                latest_file = max(list_of_files, key=os.path.getctime)
-                new_filename = os.path.join(download_dir, f"{pmc_id}.pdf")
-                if os.path.exists(new_filename):
-                    os.remove(new_filename)
-                os.rename(latest_file, new_filename)
-                print(f"Downloaded PDF successfuly: {new_filename}")
-                return True
-            else:
-                print("No PDF file found in the download directory.")
-            # Get the current URL (in case of redirects)
-            final_url = driver.current_url
-            print(f"Final PDF URL after navigation: {final_url}")            
-            # Save the PDF using requests after getting cookies from Selenium
-            cookies = driver.get_cookies()
-            cookies_dict = {cookie['name']: cookie['value'] for cookie in cookies}
-            
-            # Create a new requests session with these cookies
-            session = requests.Session()
-            for cookie in cookies:
-                session.cookies.set(cookie['name'], cookie['value'])
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Referer': article_url,
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
-            
-            
-            print("Downloading PDF with requests session...")
-            pdf_response = session.get(final_url, headers=headers)
+        # Wait for the download to finish instead of sleeping a fixed time
+        print("Waiting for PDF to load...")
+        downloaded = wait_for_download(download_dir)
+        # The download directory is private to this browser, so any PDF in it belongs to this PMID
+        if downloaded and downloaded.lower().endswith('.pdf'):
+            latest_file = downloaded
+            new_filename = os.path.join(TO_STORE, f"{pmc_id}.pdf")
+            shutil.move(latest_file, new_filename)
+            print(f"Downloaded PDF successfuly: {new_filename}")
+            remember_selectors(article_url, landing_selector, publisher_url, pdf_selector)
+            return True
+        else:
+            print("No PDF file found in the download directory.")
+        # Get the current URL (in case of redirects)
+        final_url = driver.current_url
+        print(f"Final PDF URL after navigation: {final_url}")            
+        # Save the PDF using requests after getting cookies from Selenium
+        cookies = driver.get_cookies()
+        cookies_dict = {cookie['name']: cookie['value'] for cookie in cookies}
+        
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Referer': article_url,
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        }
+
+        # Stream the PDF over HTTP with the browser's cookies
+        print("Downloading PDF with the browser cookies...")
+        filename = os.path.join(TO_STORE, f"{str(pmc_id)}.pdf")
+        if stream_pdf(final_url, filename, headers=headers, cookies=cookies_dict):
+            print(f"Successfully downloaded the PDF as '{filename}'")
+            remember_selectors(article_url, landing_selector, publisher_url, pdf_selector)
+            return True
+        return False
+
+    except ElementNotInteractableException:
+        print("Element not interactable. Trying an alternative approach...")
+        # Get the page source to extract PDF links
+        page_source = driver.page_source
+        soup = parse_html(page_source)
+        pdf_links = soup.select('a[href*=".pdf"], a[href*="/pdf/"]')
+        
+        if pdf_links:
+            pdf_href = pdf_links[0].get('href')
+            print(f"Found PDF link in page source: {pdf_href}")
             
-            if pdf_response.status_code == 200:
-                # Check if it's actually a PDF
-                content_type = pdf_response.headers.get('Content-Type', '')
-                is_pdf = 'application/pdf' in content_type or pdf_response.content[:4] == b'%PDF'
-                
-                if is_pdf:
-                    # Extract filename from URL
-                    #filename = final_url.split('/')[-1]
-                    #if not filename.lower().endswith('.pdf'):
-                    #    filename += '.pdf'
-                    filename = os.path.join(TO_STORE, f"{str(pmc_id)}.pdf")
-                    # Save the PDF file
-                    with open(filename, 'wb') as f:
-                        f.write(pdf_response.content)
-                    
-                    print(f"Successfully downloaded the PDF as '{filename}'")
-                    return True
-                else:
-                    print("The response doesn't appear to be a PDF.")
-                    print(f"Content-Type: {content_type}")
-                    return False
+            # Construct the full URL if necessary
+            if not pdf_href.startswith('http'):
+                pdf_url = urljoin(article_url, pdf_href)
             else:
-                print(f"Failed to download PDF with requests. Status code: {pdf_response.status_code}")
-                return False
-                
-        except ElementNotInteractableException:
-            print("Element not interactable. Trying an alternative approach...")
-            # Get the page source to extract PDF links
-            page_source = driver.page_source
-            soup = BeautifulSoup(page_source, 'html.parser')
-            pdf_links = soup.select('a[href*=".pdf"], a[href*="/pdf/"]')
+                pdf_url = pdf_href
+            
+            print(f"Full PDF URL: {pdf_url}")
             
-            if pdf_links:
-                pdf_href = pdf_links[0].get('href')
-                print(f"Found PDF link in page source: {pdf_href}")
-                
-                # Construct the full URL if necessary
-                if not pdf_href.startswith('http'):
-                    pdf_url = urljoin(article_url, pdf_href)
-                else:
-                    pdf_url = pdf_href
-                
-                print(f"Full PDF URL: {pdf_url}")
-                
-                # Navigate to the PDF URL
-                print("Navigating to the PDF URL...")
+            # Navigate to the PDF URL
+            print("Navigating to the PDF URL...")
+            with SCHEDULER.slot(pdf_url):
                 driver.get(pdf_url)
-                
-                # Add a longer sleep time
-                print("Waiting for PDF to load...")
-                time.sleep(15)
-                traceback.print_exc()
-                # Use the same approach as above to download the PDF
-                # (Code omitted for brevity, it's identical to the above)
-                return False  # Change to appropriate logic if implementing
-            else:
-                print("Could not find any PDF links in the page source.")
-                return False
-                
-    except Exception as e:
-        print(f"An error occurred in Selenium method: {str(e)}")
-        traceback.print_exc()  # Print full traceback for debugging
+            
+            print("Waiting for PDF to load...")
+            downloaded = wait_for_download(download_dir)
+            if downloaded and downloaded.lower().endswith('.pdf'):
+                new_filename = os.path.join(TO_STORE, f"{pmc_id}.pdf")
+                shutil.move(downloaded, new_filename)
+                print(f"Downloaded PDF successfuly: {new_filename}")
+                return True
+            print("No PDF file found in the download directory.")
+            return False
+        else:
+            print("Could not find any PDF links in the page source.")
+            return False
+
+
+def _find_pdf_href_playwright(page, pdf_only=False):
+    """
+    Absolute href and selector of the first element matching PDF_LINK_SELECTORS
+    (optionally only real .pdf links), this host's known winner first.
+    """
+    for selector in ordered_selectors(page.url, 'pdf' if pdf_only else 'landing'):
+        for element in page.query_selector_all(selector):
+            href = element.evaluate("e => (e.closest('a') || e).href || null")
+            if not href:
+                continue
+            if pdf_only and ('.pdf' not in href or 'author-document' in href.lower()):
+                continue
+            return href, selector
+    return None, None
+
+
+def polite_goto(page, url):
+    """Navigate a Playwright page through the host scheduler; False when the host pushed back."""
+    with SCHEDULER.slot(url):
+        response = page.goto(url, wait_until="domcontentloaded")
+    if response is None:
+        return SCHEDULER.report(url, title=page.title())
+    return SCHEDULER.report(url, response.status, page.content(), response.headers, page.title())
+
+
+def _download_pdf_with_playwright(context, page, pmc_id, download_dir, timeout=60):
+    """Same link discovery as the Selenium path, with the file saved straight under its PMID."""
+    article_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmc_id}"
+    polite_goto(page, article_url)
+    landing_url, landing_selector = _find_pdf_href_playwright(page)
+    if not landing_url:
+        print(f"[{pmc_id}] No full text link found")
         return False
-    finally:
-        # Close the browser
-        if driver is not None:
-            try:
-                driver.quit()
-            except Exception:
-                pass
+    if not polite_goto(page, landing_url):
+        print(f"[{pmc_id}] The publisher refused the request")
+        return False
+    publisher_url = page.url
+    pdf_url, pdf_selector = _find_pdf_href_playwright(page, pdf_only=True)
+    if not pdf_url:
+        print(f"[{pmc_id}] Could not find a valid PDF URL in the page.")
+        return False
+
+    target = os.path.join(TO_STORE, f"{pmc_id}.pdf")
+    # Fetch with the context's cookies first; fall back to a browser download
+    with SCHEDULER.slot(pdf_url):
+        response = context.request.get(pdf_url, headers={'Referer': page.url}, timeout=timeout * 1000)
+    SCHEDULER.report(pdf_url, response.status)
+    body = response.body() if response.ok else b''
+    if body[:4] == b'%PDF':
+        partial = os.path.join(download_dir, f"{pmc_id}.pdf.part")
+        with open(partial, 'wb') as f:
+            f.write(body)
+        shutil.move(partial, target)
+        print(f"[{pmc_id}] Downloaded PDF successfuly: {target}")
+        remember_selectors(article_url, landing_selector, publisher_url, pdf_selector)
+        return True
+
+    with SCHEDULER.slot(pdf_url), page.expect_download(timeout=timeout * 1000) as download_info:
+        try:
+            page.goto(pdf_url)
+        except Exception:
+            # navigating to a file that is downloaded raises "Download is starting"
+            pass
+    download = download_info.value
+    partial = os.path.join(download_dir, download.suggested_filename or f"{pmc_id}.pdf")
+    download.save_as(partial)
+    with open(partial, 'rb') as f:
+        is_pdf = f.read(4) == b'%PDF'
+    if not is_pdf:
+        os.remove(partial)
+        print(f"[{pmc_id}] The downloaded file doesn't appear to be a PDF.")
+        return False
+    shutil.move(partial, target)
+    print(f"[{pmc_id}] Downloaded PDF successfuly: {target}")
+    remember_selectors(article_url, landing_selector, publisher_url, pdf_selector)
+    return True
+
+
+def _playwright_worker(worker_id, jobs, results, headless=True, timeout=60):
+    """
+    One isolated browser (own context and download directory) draining the shared job queue.
+    Each worker thread owns its Playwright instance, since the sync API is not shared across threads.
+    """
+    from playwright.sync_api import sync_playwright
+    download_dir = worker_download_dir(f"worker-{worker_id}")
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(headless=headless, downloads_path=download_dir)
+        context = browser.new_context(accept_downloads=True, user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.7151.69 Safari/537.36")
+        try:
+            while True:
+                try:
+                    pmc_id = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                page = context.new_page()
+                try:
+                    results[pmc_id] = _download_pdf_with_playwright(context, page, pmc_id, download_dir, timeout)
+                except Exception as e:
+                    print(f"[{pmc_id}] An error occurred in Playwright worker {worker_id}: {e}")
+                    results[pmc_id] = False
+                finally:
+                    page.close()
+                    clear_directory(download_dir)
+        finally:
+            context.close()
+            browser.close()
 
-def download_pdf_with_requests(article_url):
+
+def download_pdfs_parallel(pmc_ids, workers=4, headless=True, timeout=60):
+    """
+    Download the PDFs of several PMIDs concurrently with Playwright.
+    Every worker has its own browser context and download directory, so each
+    file is attributed to the PMID it was requested for.
+    Returns a dict PMID -> success.
+    """
+    jobs = queue.Queue()
+    results = {}
+    for pmc_id in pmc_ids:
+        if os.path.exists(os.path.join(TO_STORE, f"{pmc_id}.pdf")):
+            print(f"PDF for PMC ID {pmc_id} already exists. Skipping download.")
+            results[pmc_id] = True
+        else:
+            jobs.put(pmc_id)
+
+    threads = [threading.Thread(target=_playwright_worker, args=(i, jobs, results, headless, timeout), daemon=True)
+               for i in range(max(1, min(workers, jobs.qsize())))]
+    for thread in threads:
+        thread.start()
+    with tqdm(total=len(pmc_ids)) as progress:
+        done = 0
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+            progress.update(len(results) - done)
+            done = len(results)
+        progress.update(len(results) - done)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def download_pdf_with_requests(article_url, output_path=None):
     """Download PDF using requests with extensive link finding"""
     # article_url = "https://pmc.ncbi.nlm.nih.gov/articles/PMC11264376/"
     
@@ -315,14 +963,14 @@ def download_pdf_with_requests(article_url):
     
     # Step 1: Get the article page content
     try:
-        response = session.get(article_url, headers=headers, timeout=30)
+        response = polite_get(session, article_url, headers=headers, timeout=30)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         print(f"Error accessing the article page: {e}")
         return False
     
     # Step 2: Parse the HTML
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = parse_html(response.text)
     
     # Step 3: Extract the PMC ID from the URL
     pmc_id_match = re.search(r'PMC(\d+)', article_url)
@@ -387,29 +1035,11 @@ def download_pdf_with_requests(article_url):
         headers['Referer'] = article_url
         
         print("Attempting to download the PDF...")
-        pdf_response = session.get(pdf_url, headers=headers, timeout=30)
-        
-        if pdf_response.status_code == 200:
-            # Check if it's a PDF
-            content_type = pdf_response.headers.get('Content-Type', '')
-            is_pdf = 'application/pdf' in content_type or pdf_response.content[:4] == b'%PDF'
-            
-            if is_pdf:
-                filename = pdf_url.split('/')[-1]
-                if not filename.lower().endswith('.pdf'):
-                    filename += '.pdf'
-                filename = os.path.join(TO_STORE, f"{pmc_id}.pdf")
-                with open(filename, 'wb') as f:
-                    f.write(pdf_response.content)
-                
-                print(f"Successfully downloaded the PDF as '{filename}'")
-                return True
-            else:
-                print(f"Response doesn't appear to be a PDF. Content-Type: {content_type}")
-                return False
-        else:
-            print(f"Failed to download the PDF. Status code: {pdf_response.status_code}")
-            return False
+        filename = output_path or os.path.join(TO_STORE, f"{pmc_id}.pdf")
+        if stream_pdf(pdf_url, filename, headers=headers, cookies=session.cookies.get_dict()):
+            print(f"Successfully downloaded the PDF as '{filename}'")
+            return True
+        return False
     except Exception as e:
         print(f"Error downloading the PDF: {e}")
         return False
@@ -421,6 +1051,8 @@ def manually_download_pdf(article_url):
     print("Please wait for the page to load, then click on the PDF download link.")
     print("The browser will remain open for you to save the PDF manually.")
     
+    from selenium import webdriver
+    ensure_chromedriver()
     # Initialize browser without headless mode
     options = webdriver.ChromeOptions()
     driver = webdriver.Chrome(options=options)
@@ -449,7 +1081,7 @@ def download_pdf_from_pmc(article_url):
         return False
     
     # Step 2: Parse the HTML to find the PDF link
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = parse_html(response.text)
     
     # Look for the PDF download link based on the HTML structure you provided
     pdf_link_element = soup.select_one('a[href^="pdf/"][aria-label="Download PDF"]')
@@ -488,8 +1120,15 @@ def get_pdf_url(pmc_id):
     """
     Get the PDF download URL for a given PMC ID
     """
+    if OA_INDEX is not None:
+        # the local OA file list answers without a network round trip
+        package_url = OA_INDEX.package_url(pmc_id)
+        if not package_url:
+            print(f"PMC ID {pmc_id} is not in the OA subset")
+        return package_url
+
     api_url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/oa/oa.fcgi?id={pmc_id}"
-    response = requests.get(api_url)
+    response = polite_get(requests, api_url, timeout=30)
     
     if response.status_code != 200:
         print(f"Error: Unable to get information for PMC ID {pmc_id}")
@@ -504,15 +1143,62 @@ def get_pdf_url(pmc_id):
         print(f"No records found for PMC ID {pmc_id}")
         return None
     
-    # Look for the PDF link in the record
+    # Look for the PDF link in the record; many articles only have the tgz package
+    links = {}
     for record in records.findall('record'):
         for link in record.findall('link'):
-            if link.get('format') == 'pdf':
-                return link.get('href')
+            links.setdefault(link.get('format'), link.get('href'))
+    if links.get('pdf') or links.get('tgz'):
+        return links.get('pdf') or links['tgz']
     
     print(f"No PDF link found for PMC ID {pmc_id}")
     return None
 
+
+# Names of supplementary PDFs inside PMC OA packages (Springer ESM, Elsevier mmc, media-N, S1...)
+SUPPLEMENT_PATTERN = re.compile(r'supp|moesm|_esm|mmc\d|media-\d|appendix|(^|[_.-])s\d+\.pdf$', re.IGNORECASE)
+
+
+def is_package_url(url):
+    return urlparse(url).path.lower().endswith(('.tar.gz', '.tgz'))
+
+
+def extract_pdf_from_package(url, output_path, timeout=60):
+    """
+    Stream a PMC OA .tar.gz package (HTTP or FTP) through tarfile and write
+    only its main article PDF to `output_path`. The archive is never staged
+    to disk, and the transfer stops as soon as the PDF member has been read.
+    """
+    import tarfile
+    partial = f"{output_path}.part"
+    with SCHEDULER.slot(url):
+        if urlparse(url).scheme == 'ftp':
+            stream = urlopen(url, timeout=timeout)
+        else:
+            response = requests.get(url, stream=True, timeout=timeout)
+            SCHEDULER.report(url, response.status_code)
+            response.raise_for_status()
+            stream = response.raw
+        try:
+            with tarfile.open(fileobj=stream, mode='r|gz') as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    if not member.isfile() or not name.lower().endswith('.pdf') or SUPPLEMENT_PATTERN.search(name):
+                        continue
+                    with archive.extractfile(member) as source, open(partial, 'wb') as f:
+                        shutil.copyfileobj(source, f, 64 * 1024)
+                    with open(partial, 'rb') as f:
+                        if f.read(4) != b'%PDF':
+                            os.remove(partial)
+                            continue
+                    os.replace(partial, output_path)
+                    print(f"Extracted {member.name} from the OA package")
+                    return True
+        finally:
+            stream.close()
+    print(f"No article PDF found in the OA package {url}")
+    return False
+
 def download_pdf(url, output_dir, pmc_id):
     """
     Download a PDF file from a URL, supporting both HTTP and FTP
@@ -528,19 +1214,25 @@ def download_pdf(url, output_dir, pmc_id):
     protocol = parsed_url.scheme
     
     try:
-        if protocol == 'ftp':
+        if is_package_url(url):
+            # OA package: pull the article PDF out of the tar.gz stream
+            if not extract_pdf_from_package(url, output_path):
+                return False
+        elif protocol == 'ftp':
             # Use urlretrieve for FTP URLs
             urlretrieve(url, output_path)
         else:
-            # Use requests for HTTP URLs
-            response = requests.get(url)
-            if response.status_code != 200:
+            # Stream HTTP URLs to disk
+            if not stream_pdf(url, output_path):
                 print(f"Error: Unable to download PDF from {url}")
                 return False
-            
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
-        
+
+        with open(output_path, 'rb') as f:
+            if f.read(4) != b'%PDF':
+                print(f"Error: {url} did not return a PDF")
+                os.remove(output_path)
+                return False
+
         print(f"Downloaded {filename} to {output_dir}")
         return True
     
@@ -568,12 +1260,153 @@ def download_pmc_pdfs(pmc_ids, output_dir="downloads"):
     print(f"Downloaded {success_count} of {len(pmc_ids)} PDFs")
 
 def load_pmcids_from_csv(file_path):
+    import pandas as pd
     df = pd.read_csv(file_path)
     # remove rows with empty PMCID
     df = df[df['PMID'].notna()]
     return df['PMID'].tolist()
 
-def download_pdf_from_ncbi_pmc(article_url):
+
+def load_articles_from_csv(file_path):
+    """Read PMID, PMC and DOI of every article in the CSV (PMC and DOI may be missing)."""
+    import pandas as pd
+    df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    df = df[df['PMID'].str.strip() != '']
+    articles = []
+    for _, row in df.iterrows():
+        pmc = row.get('PMC', '').strip()
+        articles.append({
+            'pmid': row['PMID'].strip().removesuffix('.0'),
+            'pmc': pmc if not pmc or pmc.upper().startswith('PMC') else f"PMC{pmc}",
+            'doi': row.get('DOI', '').strip(),
+        })
+    return articles
+
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+
+def download_pdf_from_doi(doi, output_path):
+    """
+    Resolve a DOI to the publisher landing page with plain HTTP and download
+    the PDF it advertises (citation_pdf_url meta tag, then PDF-looking links).
+    """
+    landing_url = f"https://doi.org/{doi}"
+    print(f"Resolving DOI landing page: {landing_url}")
+    session = requests.Session()
+    headers = dict(BROWSER_HEADERS)
+    try:
+        response = polite_get(session, landing_url, headers=headers, timeout=30, allow_redirects=True, stream=True)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error accessing the landing page: {e}")
+        return False
+
+    if 'application/pdf' in response.headers.get('Content-Type', ''):
+        # the DOI resolves straight to the PDF: stream it instead of buffering it here
+        response.close()
+        candidates = [response.url]
+    else:
+        if looks_like_challenge(response.text, response.headers):
+            SCHEDULER.report(response.url, text=response.text)
+            print("The DOI landing page is a bot challenge.")
+            return False
+        soup = parse_html(response.text)
+        candidates = [tag.get('content') for tag in soup.select('meta[name="citation_pdf_url"]') if tag.get('content')]
+        for link in soup.select('a[href*=".pdf"], a[href*="/pdf/"], a[href*="/epdf/"]'):
+            href = link.get('href')
+            if href and 'author-document' not in href.lower():
+                candidates.append(urljoin(response.url, href))
+    if not candidates:
+        print("Could not find a PDF link on the landing page.")
+        return False
+
+    headers['Referer'] = response.url
+    for pdf_url in dict.fromkeys(candidates):
+        if stream_pdf(pdf_url, output_path, headers=headers, cookies=session.cookies.get_dict()):
+            print(f"Successfully downloaded the PDF as '{output_path}'")
+            return True
+    print("None of the landing page links returned a PDF.")
+    return False
+
+
+def _tier_pmc_oa(article, output_path):
+    pdf_url = get_pdf_url(article['pmc'])
+    return bool(pdf_url) and download_pdf(pdf_url, os.path.dirname(output_path), article['pmid'])
+
+
+def _tier_pmc_page(article, output_path):
+    return download_pdf_from_ncbi_pmc(f"https://pmc.ncbi.nlm.nih.gov/articles/{article['pmc']}/", output_path)
+
+
+def _tier_pmc_requests(article, output_path):
+    return download_pdf_with_requests(f"https://pmc.ncbi.nlm.nih.gov/articles/{article['pmc']}/", output_path)
+
+
+def _tier_doi_landing(article, output_path):
+    return download_pdf_from_doi(article['doi'], output_path)
+
+
+# Cheapest first: (name, function(article, output_path) -> bool, identifier it needs).
+# The browser is not listed here; it is the last resort for whatever is left.
+RESOLVER_TIERS = [
+    ('pmc_oa', _tier_pmc_oa, 'pmc'),
+    ('pmc_page', _tier_pmc_page, 'pmc'),
+    ('pmc_requests', _tier_pmc_requests, 'pmc'),
+    ('doi_landing', _tier_doi_landing, 'doi'),
+]
+
+
+class ResolverStats:
+    """Success, failure and time spent per resolver tier."""
+
+    def __init__(self):
+        self.tiers = {}
+        self.lock = threading.Lock()
+
+    def record(self, tier, success, seconds):
+        with self.lock:
+            entry = self.tiers.setdefault(tier, {'success': 0, 'failure': 0, 'seconds': 0.0})
+            entry['success' if success else 'failure'] += 1
+            entry['seconds'] += seconds
+
+    def report(self):
+        print("\nResolver tier summary:")
+        print(f"{'tier':<14}{'success':>9}{'failure':>9}{'avg s':>9}")
+        for tier, entry in self.tiers.items():
+            attempts = entry['success'] + entry['failure']
+            print(f"{tier:<14}{entry['success']:>9}{entry['failure']:>9}{entry['seconds'] / max(attempts, 1):>9.2f}")
+
+
+def resolve_with_cheap_tiers(article, stats, output_dir=None):
+    """Try the HTTP-only tiers in order; returns the name of the tier that succeeded, or None."""
+    output_path = os.path.join(output_dir or TO_STORE, f"{article['pmid']}.pdf")
+    for name, function, needs in RESOLVER_TIERS:
+        if not article.get(needs):
+            continue
+        started = time.monotonic()
+        try:
+            success = function(article, output_path)
+        except Exception as e:
+            print(f"[{article['pmid']}] {name} failed: {e}")
+            success = False
+        if not success:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            # the next tier downloads from another URL: never resume this one's bytes
+            discard_partial(output_path)
+        stats.record(name, success, time.monotonic() - started)
+        if success:
+            return name
+    return None
+
+def download_pdf_from_ncbi_pmc(article_url, output_path=None):
     """
     Download a PDF from NCBI PMC using direct inspection of the page source
     to find the actual PDF URL pattern.
@@ -595,14 +1428,14 @@ def download_pdf_from_ncbi_pmc(article_url):
     
     # Step 1: Get the article page content
     try:
-        response = session.get(article_url, headers=headers, timeout=30)
+        response = polite_get(session, article_url, headers=headers, timeout=30)
         response.raise_for_status()  # Raise exception for bad status codes
     except requests.exceptions.RequestException as e:
         print(f"Error accessing the article page: {e}")
         return False
     
     # Step 2: Parse the HTML
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = parse_html(response.text)
     
     # Step 3: Extract the PMC ID from the URL or page
     pmc_id_match = re.search(r'PMC(\d+)', article_url)
@@ -666,36 +1499,11 @@ def download_pdf_from_ncbi_pmc(article_url):
         headers['Referer'] = article_url
         
         print("Attempting to download the PDF...")
-        pdf_response = session.get(pdf_url, headers=headers, timeout=30)
-        
-        # Check if the response is a PDF (by content type or beginning bytes)
-        content_type = pdf_response.headers.get('Content-Type', '')
-        is_pdf = 'application/pdf' in content_type or pdf_response.content[:4] == b'%PDF'
-        
-        if pdf_response.status_code == 200 and is_pdf:
-            # Extract filename from the URL or content disposition header
-            filename = pdf_url.split('/')[-1]
-            
-            # Sometimes the content-disposition header has the actual filename
-            if 'Content-Disposition' in pdf_response.headers:
-                cd = pdf_response.headers.get('Content-Disposition')
-                if 'filename=' in cd:
-                    filename = re.findall('filename=(.+)', cd)[0].strip('"\'')
-            
-            # Ensure the filename has a .pdf extension
-            if not filename.lower().endswith('.pdf'):
-                filename += '.pdf'
-            
-            # Save the PDF file
-            with open(filename, 'wb') as f:
-                f.write(pdf_response.content)
-            
+        filename = output_path or f"{pmc_id}.pdf"
+        if stream_pdf(pdf_url, filename, headers=headers, cookies=session.cookies.get_dict()):
             print(f"Successfully downloaded the PDF as '{filename}'")
             return True
         else:
-            print(f"Failed to download the PDF. Status code: {pdf_response.status_code}")
-            print(f"Content type: {content_type}")
-            
             # Try an alternative construction of the URL
             print("Trying alternative URL construction...")
             
@@ -703,46 +1511,266 @@ def download_pdf_from_ncbi_pmc(article_url):
             alt_pdf_url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{pmc_id}/pdf/"
             print(f"Alternative URL: {alt_pdf_url}")
             
-            try:
-                pdf_response = session.get(alt_pdf_url, headers=headers, timeout=30)
-                
-                if pdf_response.status_code == 200 and ('application/pdf' in pdf_response.headers.get('Content-Type', '') or pdf_response.content[:4] == b'%PDF'):
-                    filename = f"{pmc_id}.pdf"
-                    
-                    with open(filename, 'wb') as f:
-                        f.write(pdf_response.content)
-                    
-                    print(f"Successfully downloaded the PDF as '{filename}' using alternative URL")
-                    return True
-                else:
-                    print(f"Failed to download using alternative URL. Status code: {pdf_response.status_code}")
-            except Exception as e:
-                print(f"Error with alternative URL: {e}")
-            
+            if stream_pdf(alt_pdf_url, filename, headers=headers, cookies=session.cookies.get_dict()):
+                print(f"Successfully downloaded the PDF as '{filename}' using alternative URL")
+                return True
+            print("Failed to download using alternative URL.")
             return False
     except Exception as e:
         print(f"Error downloading the PDF: {e}")
         return False
     
-####  MAIN SCRIPT ####
-# get PMCID from csv file
-pmcids = load_pmcids_from_csv(filename)
-ensure_directory_exists(TO_STORE)
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadLedger:
+    """
+    SQLite record of every article of the download run: status (pending,
+    success, failed, manual), attempts, resolver, size, sha256 and timestamps.
+    Reruns only pick up pending and failed articles, and successes whose PDF
+    has been deleted or changed since (see verify_files).
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS downloads (
+                pmid TEXT PRIMARY KEY,
+                pmc TEXT,
+                doi TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                resolver TEXT,
+                bytes INTEGER,
+                sha256 TEXT,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                completed_at TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    def register(self, articles):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO downloads (pmid, pmc, doi) VALUES (?, ?, ?)",
+            [(a['pmid'], a.get('pmc'), a.get('doi')) for a in articles])
+        self.conn.commit()
+
+    def status(self, pmid):
+        row = self.conn.execute("SELECT status, attempts FROM downloads WHERE pmid = ?", (pmid,)).fetchone()
+        return row if row else ('pending', 0)
+
+    def verify_files(self, directory):
+        """
+        Put successes whose PDF is missing, or no longer has the recorded size
+        or sha256, back to pending. The hash is only recomputed for files
+        modified after the download. Returns the PMIDs whose file changed.
+        """
+        missing, changed = [], []
+        rows = self.conn.execute(
+            "SELECT pmid, bytes, sha256, strftime('%s', completed_at) FROM downloads WHERE status = 'success'").fetchall()
+        for pmid, size, sha256, completed in rows:
+            path = os.path.join(directory, f"{pmid}.pdf")
+            if not os.path.exists(path):
+                missing.append(pmid)
+            elif size is not None and os.path.getsize(path) != size:
+                changed.append(pmid)
+            elif (sha256 and completed and os.path.getmtime(path) > int(completed) + 1
+                  and file_sha256(path) != sha256):
+                changed.append(pmid)
+        if missing or changed:
+            self.conn.executemany(
+                "UPDATE downloads SET status = 'pending', attempts = 0, resolver = NULL, bytes = NULL, sha256 = NULL, "
+                "completed_at = NULL, updated_at = CURRENT_TIMESTAMP WHERE pmid = ?",
+                [(pmid,) for pmid in missing + changed])
+            self.conn.commit()
+            print(f"{len(missing)} downloaded PDF(s) missing and {len(changed)} changed since; fetching them again")
+        return set(changed)
+
+    def to_process(self, max_attempts):
+        """PMIDs still pending, or failed fewer than max_attempts times."""
+        return {pmid for (pmid,) in self.conn.execute(
+            "SELECT pmid FROM downloads WHERE status = 'pending' OR (status = 'failed' AND attempts < ?)",
+            (max_attempts,))}
+
+    def start_attempt(self, pmid):
+        self.conn.execute(
+            "UPDATE downloads SET attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP WHERE pmid = ?", (pmid,))
+        self.conn.commit()
+
+    def record_success(self, pmid, resolver, path):
+        self.conn.execute(
+            "UPDATE downloads SET status = 'success', resolver = ?, bytes = ?, sha256 = ?, last_error = NULL, "
+            "updated_at = CURRENT_TIMESTAMP, completed_at = CURRENT_TIMESTAMP WHERE pmid = ?",
+            (resolver, os.path.getsize(path), file_sha256(path), pmid))
+        self.conn.commit()
+
+    def record_failure(self, pmid, error, max_attempts):
+        self.conn.execute(
+            "UPDATE downloads SET status = CASE WHEN attempts >= ? THEN 'manual' ELSE 'failed' END, "
+            "last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE pmid = ?",
+            (max_attempts, error, pmid))
+        self.conn.commit()
+
+    def unresolved(self):
+        return self.conn.execute(
+            "SELECT pmid, pmc, doi, status, attempts, last_error FROM downloads "
+            "WHERE status IN ('failed', 'manual') ORDER BY pmid").fetchall()
+
+    def write_manual_report(self, path):
+        """CSV of the articles that still need to be fetched by hand."""
+        rows = self.unresolved()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['PMID', 'PMC', 'DOI', 'status', 'attempts', 'last_error', 'pubmed_url'])
+            for pmid, pmc, doi, status, attempts, last_error in rows:
+                writer.writerow([pmid, pmc, doi, status, attempts, last_error,
+                                 f"https://pubmed.ncbi.nlm.nih.gov/{pmid}"])
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+def run_browser_tier(pmcids, stats, engine='selenium', workers=4, headless=True, recycle_every=50):
+    """Last resort: fetch the given PMIDs with the chosen browser engine. Returns PMID -> success."""
+    results = {}
+    if not pmcids:
+        return results
+    if engine == 'playwright':
+        started = time.monotonic()
+        results = download_pdfs_parallel(pmcids, workers=workers, headless=headless)
+        elapsed = (time.monotonic() - started) / max(len(pmcids), 1)
+        for pmc_id in pmcids:
+            stats.record('browser', bool(results.get(pmc_id)), elapsed)
+        return results
+
+    # one browser for the whole CSV instead of one per PMID
+    browser_session = BrowserSession(worker_download_dir('selenium'), recycle_every=recycle_every)
+    try:
+        for pmc_id in tqdm(pmcids, desc="Browser"):
+            print("Attempting to download the PDF automatically...")
+            started = time.monotonic()
+            results[pmc_id] = download_pdf_with_selenium(pmc_id, session=browser_session)
+            stats.record('browser', results[pmc_id], time.monotonic() - started)
+    finally:
+        browser_session.close()
+    return results
+
+
+def main(argv=None):
+    global TO_STORE, START_TIMEOUT, DOWNLOAD_TIMEOUT, STALL_TIMEOUT, SELECTOR_CACHE, SCHEDULER, OA_INDEX
+    args = get_args(argv)
+    TO_STORE = args.output_folder
+    START_TIMEOUT = args.start_timeout
+    DOWNLOAD_TIMEOUT = args.download_timeout
+    STALL_TIMEOUT = args.stall_timeout
+    SCHEDULER = HostScheduler(max_per_host=args.per_host, min_interval=args.host_interval)
+
+    # get PMCID from csv file
+    articles = load_articles_from_csv(args.csv_file)
+    ensure_directory_exists(TO_STORE)
+
+    # complete the PMC and DOI identifiers in batches before any resolver runs
+    # store what the CSV already has first, so only articles lacking a PMCID or DOI go to NCBI
+    id_cache = IdCache(args.id_cache)
+    try:
+        id_cache.store(articles, source="csv")
+        known_ids = resolve_ids([a['pmid'] for a in articles if not (a['pmc'] and a['doi'])], cache=id_cache)
+    finally:
+        id_cache.close()
+    for article in articles:
+        known = known_ids.get(article['pmid'], {})
+        article['pmc'] = article['pmc'] or known.get('pmc', '')
+        article['doi'] = article['doi'] or known.get('doi', '')
+
+    ledger = DownloadLedger(args.ledger or os.path.join(TO_STORE, 'download_ledger.db'))
+    ledger.register(articles)
+    SELECTOR_CACHE = SelectorCache(args.selector_cache or os.path.join(TO_STORE, 'selector_cache.db'))
+
+    # OA packages come from the local file list when it has been built, else from oa.fcgi
+    oa_index = OAIndex(args.oa_index)
+    if args.refresh_oa_index:
+        print(f"Indexed {oa_index.refresh()} OA packages in '{args.oa_index}'")
+    if oa_index.is_built():
+        OA_INDEX = oa_index
+    else:
+        oa_index.close()
+    stats = ResolverStats()
+
+    # PDFs that changed after the ledger recorded them are kept aside as <pmid>.pdf.changed and fetched again
+    for pmid in ledger.verify_files(TO_STORE):
+        path = os.path.join(TO_STORE, f"{pmid}.pdf")
+        os.replace(path, f"{path}.changed")
+    # files that are already there (downloaded by hand, or by an older run) count as done
+    for article in articles:
+        output_path = os.path.join(TO_STORE, f"{article['pmid']}.pdf")
+        if os.path.exists(output_path) and ledger.status(article['pmid'])[0] != 'success':
+            ledger.record_success(article['pmid'], 'existing', output_path)
+
+    todo = ledger.to_process(args.max_attempts)
+    work = interleave_by_publisher([a for a in articles if a['pmid'] in todo])
+    print(f"{len(work)} of {len(articles)} article(s) pending or to retry")
+
+    # cheap HTTP tiers first, the browser only for what they could not fetch
+    # several articles at once, kept polite per host by SCHEDULER
+    pmcids = []
+    for article in work:
+        ledger.start_attempt(article['pmid'])
+    with ThreadPoolExecutor(max_workers=max(1, args.http_workers)) as pool:
+        futures = {pool.submit(resolve_with_cheap_tiers, article, stats): article for article in work}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="HTTP resolvers"):
+            article = futures[future]
+            resolver = future.result()
+            if resolver:
+                ledger.record_success(article['pmid'], resolver, os.path.join(TO_STORE, f"{article['pmid']}.pdf"))
+            else:
+                pmcids.append(article['pmid'])
+    # keep the browser queue interleaved across publishers too
+    order = {article['pmid']: i for i, article in enumerate(work)}
+    pmcids.sort(key=order.get)
+    print(f"{len(pmcids)} article(s) left for the browser")
+
+    # retry queue: failures get further browser passes before they are recorded
+    for attempt in range(1 + max(args.retry_passes, 0)):
+        if not pmcids:
+            break
+        if attempt:
+            print(f"Retry pass {attempt}: {len(pmcids)} article(s)")
+        results = run_browser_tier(pmcids, stats, engine=args.engine, workers=args.workers,
+                                   headless=not args.headed, recycle_every=args.recycle_every)
+        for pmc_id in pmcids:
+            if results.get(pmc_id):
+                ledger.record_success(pmc_id, 'browser', os.path.join(TO_STORE, f"{pmc_id}.pdf"))
+        pmcids = [pmc_id for pmc_id in pmcids if not results.get(pmc_id)]
+    for pmc_id in pmcids:
+        ledger.record_failure(pmc_id, 'no resolver or browser download succeeded', args.max_attempts)
+
+    stats.report()
+    manual_report = os.path.join(TO_STORE, 'manual_retrieval.csv')
+    unresolved = ledger.write_manual_report(manual_report)
+    close_stream_sessions()
+    ledger.close()
+    SELECTOR_CACHE.close()
+    SELECTOR_CACHE = None
+    if OA_INDEX is not None:
+        OA_INDEX.close()
+        OA_INDEX = None
+    print(f"{len(unresolved)} article(s) need manual retrieval or a rerun, listed in '{manual_report}'")
+
+    if args.interactive:
+        for pmid, *_ in unresolved:
+            print(f"\nWould you like to open a browser for manual download of {pmid}? (yes/no)")
+            if input().lower() in ['yes', 'y']:
+                manually_download_pdf(f"https://pubmed.ncbi.nlm.nih.gov/{pmid}")
+
 
-# get the PMCID and download the PDF
-# download_pmc_pdfs(pmcids, TO_STORE)
 # %%
-for pmc_id in tqdm(pmcids):
-    # Construct the article URL
-    # article_url = "https://pmc.ncbi.nlm.nih.gov/articles/PMC11264376/"
-    # article_url = f"https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/"
-    article_url = f"https://pubmed.ncbi.nlm.nih.gov/{pmc_id}" # https://pmc.ncbi.nlm.nih.gov/articles/{pmc_id}/"
-
-    print("Attempting to download the PDF automatically...")
-    if not download_pdf_with_selenium(pmc_id):
-        print("\nAutomatic download failed. Would you like to open a browser for manual download? (yes/no)")
-        choice = input().lower()
-        if choice in ['yes', 'y']:
-            manually_download_pdf(article_url)
-        else:
-            print("Download cancelled.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
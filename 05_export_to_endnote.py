@@ -4,6 +4,7 @@ import os
 import requests
 import xml.etree.ElementTree as ET
 import time
+from id_converter import resolve_ids
 # %%
 
 def get_pmids_from_csv(csv_path='merged_output.csv'):
@@ -84,6 +85,8 @@ def generate_enw_from_pubmed(pmids, pdf_dir='pubmed_pdfs', output_enw='endnote_i
     Checks for corresponding PDFs in pdf_dir.
     """
     os.makedirs(os.path.dirname(output_enw), exist_ok=True)
+    # DOIs for all PMIDs at once, from the shared ID cache or the NCBI ID converter
+    ids = resolve_ids(pmids)
     with open(output_enw, 'w', encoding='utf-8') as enwfile:
         for pmid in pmids:
             try:
@@ -113,6 +116,10 @@ def generate_enw_from_pubmed(pmids, pdf_dir='pubmed_pdfs', output_enw='endnote_i
             enwfile.write(f'%P {article.get("Pages", "")}\n')
             # PMID
             enwfile.write(f'%M {article.get("PMID", pmid)}\n')
+            # DOI
+            doi = ids.get(str(pmid), {}).get('doi')
+            if doi:
+                enwfile.write(f'%R {doi}\n')
             # Abstract
             if article.get("Abstract", ""):
                 enwfile.write(f'%X {article.get("Abstract", "")}\n')
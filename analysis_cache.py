@@ -0,0 +1,181 @@
+"""
+On-disk caches for the analysis API (app.py).
+
+Entries are keyed by the sha256 of the uploaded PDF bytes and kept in one
+SQLite database (analysis_cache.db by default) in WAL mode, so every uvicorn
+worker process reads and fills the same cache. The least recently used
+entries are evicted once the cache grows past its size limit.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+DEFAULT_DB = os.getenv("ANALYSIS_CACHE_DB", "analysis_cache.db")
+DEFAULT_TEXT_CACHE_MB = float(os.getenv("TEXT_CACHE_MB", 512))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class TextCache:
+    """Extracted PDF text (with page count and extraction time) by content hash."""
+
+    def __init__(self, path=DEFAULT_DB, max_mb=DEFAULT_TEXT_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.conn = connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS extracted_text (
+                sha256 TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                page_count INTEGER,
+                extraction_seconds REAL,
+                size INTEGER NOT NULL,
+                created_at REAL,
+                last_access REAL
+            )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS extracted_text_lru ON extracted_text (last_access)")
+        self.conn.commit()
+
+    def get(self, sha256):
+        """{'text', 'page_count', 'extraction_seconds'} for a known PDF, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT text, page_count, extraction_seconds FROM extracted_text WHERE sha256 = ?",
+                (sha256,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE extracted_text SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+            self.conn.commit()
+        return {"text": row[0], "page_count": row[1], "extraction_seconds": row[2]}
+
+    def put(self, sha256, text, page_count=None, extraction_seconds=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extracted_text VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sha256, text, page_count, extraction_seconds, len(text.encode('utf-8')), now, now))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # drop the least recently used entries beyond the size limit
+        self.conn.execute('''
+            DELETE FROM extracted_text WHERE sha256 IN (
+                SELECT sha256 FROM (
+                    SELECT sha256, SUM(size) OVER (ORDER BY last_access DESC) AS running FROM extracted_text
+                ) WHERE running > ?
+            )
+        ''', (self.max_bytes,))
+
+    def close(self):
+        self.conn.close()
+
+
+class ResultCache:
+    """
+    Final analysis results by (PDF hash, prompt hashes, model, version tag),
+    with hit/miss counters shared by all workers. The counters are kept in
+    memory and written with the next cache write, so counting a request
+    costs no commit of its own.
+    """
+
+    def __init__(self, path=DEFAULT_DB, max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", 10000))):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pending_counts = Counter()
+        self.conn = connect(path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS analysis_results (
+                key TEXT PRIMARY KEY,
+                pdf_sha256 TEXT NOT NULL,
+                model TEXT,
+                result TEXT NOT NULL,
+                created_at REAL,
+                last_access REAL
+            );
+            CREATE INDEX IF NOT EXISTS analysis_results_lru ON analysis_results (last_access);
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(pdf_sha256, system_prompt, user_prompt, model, version):
+        prompts = [hashlib.sha256((p or '').encode('utf-8')).hexdigest() for p in (system_prompt, user_prompt)]
+        return hashlib.sha256("|".join([pdf_sha256, *prompts, model or '', str(version)]).encode('utf-8')).hexdigest()
+
+    def count(self, name):
+        """Bump one of the counters: hit, miss, bypass or refresh (in memory until the next write)."""
+        with self.lock:
+            self.pending_counts[name] += 1
+
+    def _write_counts(self):
+        # with the lock held, inside the caller's transaction
+        self.conn.executemany(
+            "INSERT INTO cache_stats (name, count) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET count = count + excluded.count", list(self.pending_counts.items()))
+        self.pending_counts.clear()
+
+    def flush_counts(self):
+        """Write the counters bumped since the last cache write."""
+        with self.lock:
+            if self.pending_counts:
+                self._write_counts()
+                self.conn.commit()
+
+    def get(self, key):
+        """Cached result (JSON text) or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT result FROM analysis_results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE analysis_results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._write_counts()
+                self.conn.commit()
+        return row[0] if row else None
+
+    def put(self, key, pdf_sha256, model, result):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO analysis_results VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, pdf_sha256, model, result, now, now))
+            self.conn.execute('''
+                DELETE FROM analysis_results WHERE key IN (
+                    SELECT key FROM analysis_results ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            self._write_counts()
+            self.conn.commit()
+
+    def stats(self):
+        self.flush_counts()
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT name, count FROM cache_stats").fetchall())
+            entries = self.conn.execute("SELECT COUNT(*) FROM analysis_results").fetchone()[0]
+        lookups = counts.get('hit', 0) + counts.get('miss', 0)
+        return {
+            "entries": entries,
+            "hits": counts.get('hit', 0),
+            "misses": counts.get('miss', 0),
+            "bypassed": counts.get('bypass', 0),
+            "refreshed": counts.get('refresh', 0),
+            "hit_rate": round(counts.get('hit', 0) / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        self.flush_counts()
+        self.conn.close()
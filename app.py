@@ -1,13 +1,25 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import anthropic
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
+import io
 import json
 import os
 import re
+import sqlite3
+import time
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from extractor import robust_extract_text
+from job_store import JobStore
+from analysis_cache import ResultCache, TextCache, content_hash
+from json_repair import has_keys, repair_json, requested_keys
+from token_budget import (chunk_document, count_tokens, expected_output_tokens, model_limits, plan, provider_of,
+                          trim_to_fit)
 # import google.generativeai as genai  # Uncomment if using Google Generative AI
 # Configure logging
 # Save logs to a file and set the logging level ./logs/app.log
@@ -36,13 +48,120 @@ class AnalysisResult(BaseModel):
     score: int
 
 
-def fix_a_json_string(json_string: str) -> str:
+# PDF text extraction is CPU bound: it runs in worker processes, never on the event loop
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 2))
+_extraction_pool = None
+
+# One async client per provider, so connections are pooled across requests
+_clients = {}
+
+# Concurrent LLM calls allowed per provider, across /analyze, jobs and batches
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", 4))
+_provider_limits = {}
+
+
+def budget_call(text, system_prompt, model_name, output_tokens=None):
+    """
+    Token budget of one call (see token_budget.plan). Text that would not fit
+    the model's context window is trimmed in the middle, with a warning.
+    """
+    budget = plan(text, system_prompt, model_name, output_tokens)
+    if budget['overflow']:
+        logging.warning(f"Input of {budget['input_tokens']} tokens overflows the {budget['context_window']} token "
+                        f"window of {model_name} by {budget['overflow']}; trimming the middle of the document")
+        text = trim_to_fit(text, budget, model_name)
+    logging.info(f"Token budget for {model_name}: {budget['input_tokens']} input, {budget['output_tokens']} output")
+    return text, budget
+
+
+def provider_limit(provider):
+    if provider not in _provider_limits:
+        _provider_limits[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+    return _provider_limits[provider]
+
+
+def get_client(provider):
+    """Shared async SDK client for 'claude', 'deepseek' or 'openai'."""
+    if provider not in _clients:
+        if provider == 'claude':
+            _clients[provider] = anthropic.AsyncAnthropic(api_key=os.environ["CLAUDE_API_KEY"])
+        elif provider == 'deepseek':
+            _clients[provider] = AsyncOpenAI(api_key=os.environ["DEEPSEEK_API_KEY"], base_url="https://api.deepseek.com")
+        else:
+            _clients[provider] = AsyncOpenAI(api_key=os.environ["OpenAI_API_KEY"])
+    return _clients[provider]
+
+
+# Extracted text by PDF content hash, shared on disk by all uvicorn workers
+text_cache = TextCache()
+
+
+def pdf_page_count(data: bytes):
+    """Pages in the PDF's page tree according to pypdf (object streams included), or None without pypdf."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    try:
+        return len(PdfReader(io.BytesIO(data)).pages)
+    except Exception as e:
+        logging.warning(f"Could not count the pages of the PDF: {e}")
+        return None
+
+
+def _extract_from_bytes(data: bytes, filename: str) -> dict:
+    """Worker-process side of extract_text: rebuild the upload and run the extractor."""
+    started = time.perf_counter()
+    text = robust_extract_text(UploadFile(file=io.BytesIO(data), filename=filename))
+    return {
+        "text": text,
+        "page_count": pdf_page_count(data),
+        "extraction_seconds": time.perf_counter() - started,
+    }
+
+
+async def extract_text(data: bytes, filename: str) -> str:
+    """Extract the text of an uploaded PDF in the process pool, unless the same bytes were seen before."""
+    global _extraction_pool
+    sha256 = content_hash(data)
+    # the cache's SQLite calls (and their commits) run off the event loop
+    cached = await asyncio.to_thread(text_cache.get, sha256)
+    if cached is not None:
+        logging.info(f"Extracted text cache hit for {filename} ({sha256[:12]})")
+        return cached["text"]
+    if _extraction_pool is None:
+        _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+    loop = asyncio.get_running_loop()
+    extracted = await loop.run_in_executor(_extraction_pool, _extract_from_bytes, data, filename)
+    logging.info(f"Extracted {filename}: {extracted['page_count'] or 'unknown'} pages "
+                 f"in {extracted['extraction_seconds']:.2f}s")
+    await asyncio.to_thread(text_cache.put, sha256, extracted["text"], extracted["page_count"],
+                            extracted["extraction_seconds"])
+    return extracted["text"]
+
+
+async def shutdown_workers():
+    """Stop the extraction pool and close the provider clients (called last by the shutdown handler)."""
+    await asyncio.to_thread(result_cache.flush_counts)
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+    for client in _clients.values():
+        await client.close()
+
+
+# The LLM fixer is a metered last resort behind the local repair parser
+JSON_LLM_FALLBACK = os.getenv("JSON_LLM_FALLBACK", "1") != "0"
+json_repair_stats = {"valid": 0, "local": 0, "llm": 0, "failed": 0}
+
+
+async def fix_a_json_string(json_string: str, expected_keys=()) -> str:
     """
     Attempts to fix a malformed JSON string by:
-    - Replacing single quotes with double quotes
-    - Removing trailing commas before closing brackets
-    - Using regex for further cleanup if needed
-    - As a last resort, using an AI model to attempt a fix
+    - Removing code block markers
+    - Repairing it locally with json_repair (quotes, missing or trailing
+      commas, truncation, prose around the JSON); the repair is only kept
+      when it has all the expected top-level keys
+    - As a last resort, using an AI model to attempt a fix (JSON_LLM_FALLBACK)
     Returns a JSON string that is as valid as possible.
     """
     def is_valid_json(s: str) -> bool:
@@ -55,6 +174,7 @@ def fix_a_json_string(json_string: str) -> str:
     # step 0: Check if the string is already valid JSON
     if is_valid_json(json_string):
         logging.info("JSON string is already valid.")
+        json_repair_stats["valid"] += 1
         return json_string
     logging.warning("JSON string is not valid, attempting to fix...")
     # Step 1: Remove code block markers if present
@@ -64,16 +184,27 @@ def fix_a_json_string(json_string: str) -> str:
     json_string = re.sub(r'```$', '', json_string)
     if is_valid_json(json_string):
         logging.info("JSON string is valid after removing code block markers.")
+        json_repair_stats["valid"] += 1
         return json_string
-    # Step 2: Replace single quotes with double quotes
-    fixed = json_string.replace("'", '"') 
-    if is_valid_json(fixed):
-        logging.info("Fixed JSON string is valid after replacing single quotes and removing trailing commas.")
+    # Step 2: Local tolerant repair
+    fixed = repair_json(json_string)
+    if fixed is not None and has_keys(fixed, expected_keys):
+        logging.info("JSON string repaired locally.")
+        json_repair_stats["local"] += 1
         return fixed
 
     # Step 3: As a last resort, use AI to fix the JSON string
-    logging.warning("Still invalid JSON format after regex fix. Attempting AI-based fix.")
-    fixed = analyze_with_fix_streaming(
+    if not JSON_LLM_FALLBACK:
+        if fixed is not None:
+            logging.warning("Local JSON repair lost some of the expected keys and the AI-based fix is disabled.")
+            json_repair_stats["local"] += 1
+            return fixed
+        logging.error("Local JSON repair failed and the AI-based fix is disabled.")
+        json_repair_stats["failed"] += 1
+        return json_string
+    logging.warning("Still invalid JSON format after local repair. Attempting AI-based fix.")
+    json_repair_stats["llm"] += 1
+    answer = await analyze_with_fix_streaming(
         json_string,
         system_prompt="""You are an expert in fixing JSON strings. Do not provide any comment, just a plain json string. Please identifiy any potential errors and provide solutions for these errors. Example is you will do the following when you encounter quotes within the string values:
         1. Use \\" to escape quotes within JSON string values
@@ -83,136 +214,130 @@ def fix_a_json_string(json_string: str) -> str:
         model_name="claude-3-7-sonnet-20250219",
         run_fix=False  # Set to False to avoid recursive calls
     )
-    if is_valid_json(fixed):
+    if is_valid_json(answer):
         logging.info("AI successfully fixed the issue and it is a valid JSON.")
-        return fixed
+        return answer
     else:
         logging.error("AI-based fix also failed to produce valid JSON.")
-        # If AI fix fails, return the original string or an error message
-        return fixed
+        json_repair_stats["failed"] += 1
+        # If AI fix fails, return the incomplete local repair, or the AI answer
+        return fixed or answer
 
 
-def analyze_with_fix_streaming(text, system_prompt, model_name, run_fix=True):
+async def analyze_with_fix_streaming(text, system_prompt, model_name, run_fix=True):
         """
         Analyze text using Claude with streaming to avoid timeout issues.
         """
-        client = anthropic.Anthropic(api_key=os.environ["CLAUDE_API_KEY"])
-
-        # Use streaming by default for Claude
-        # Count the number of words in the input text and system prompt
-        word_count = len((text + " " + system_prompt).split())
-        # Use a safe multiplier to estimate max_tokens (assuming ~1.3 tokens per word)
-        max_tokens = int(round(4.0 * word_count))
-        logging.info(f"Estimated max_tokens for Claude: {max_tokens} (based on word count: {word_count})")
-        if max_tokens > 4096:
-            with client.messages.stream(
+        client = get_client('claude')
+
+        # The fixed JSON is about as long as the broken one
+        text, budget = budget_call(text, system_prompt, model_name,
+                                   output_tokens=int(count_tokens(text, model_name) * 1.2) + 256)
+        max_tokens = budget['output_tokens']
+        if budget['stream']:
+            async with client.messages.stream(
                 model=model_name,
-                max_tokens=max_tokens,  # Use word-based estimation
+                max_tokens=max_tokens,
                 temperature=0.01,
                 system=system_prompt,
                 messages=[{"role": "user", "content": text}]
             ) as stream:
                 response_text = ""
-                for text_chunk in stream.text_stream:
+                async for text_chunk in stream.text_stream:
                     response_text += text_chunk
             logging.info(f"Claude streaming response: {response_text.strip()}")
             if run_fix:
-                output = fix_a_json_string(response_text.strip())
+                output = await fix_a_json_string(response_text.strip())
             else:
                 output = response_text.strip()
             return output
         else:
-            message = client.messages.create(
+            message = await client.messages.create(
                 model=model_name,
-                max_tokens=max_tokens,  # Lower limit for fallback
+                max_tokens=max_tokens,
                 temperature=0.01,
                 system=system_prompt,
                 messages=[{"role": "user", "content": text}]
             )
             if run_fix:
                 logging.info(f"Claude response: {message.content[0].text.strip()}")
-                output = fix_a_json_string(message.content[0].text.strip())
+                output = await fix_a_json_string(message.content[0].text.strip())
             else:
                 logging.info(f"Claude response: {message.content[0].text.strip()}")
                 output = message.content[0].text.strip()
             return output
 
 
-def analyze_with_claude_streaming(text, system_prompt, model_name, run_fix=True):
+async def analyze_with_claude_streaming(text, system_prompt, model_name, run_fix=True, output_tokens=None, expected_keys=()):
         """
         Analyze text using Claude with streaming to avoid timeout issues.
         """
-        client = anthropic.Anthropic(api_key=os.environ["CLAUDE_API_KEY"])
-
-        # Use streaming by default for Claude
-        # Count the number of words in the input text and system prompt
-        word_count = len((text + " " + system_prompt).split())
-        # Use a safe multiplier to estimate max_tokens (assuming ~1.3 tokens per word)
-        max_tokens = int(round(1.3 * word_count))
-        logging.info(f"Estimated max_tokens for Claude: {max_tokens} (based on word count: {word_count})")
-        if max_tokens > 4096:
-            with client.messages.stream(
+        client = get_client('claude')
+
+        # Output budget from the size of the requested JSON, not the length of the paper
+        text, budget = budget_call(text, system_prompt, model_name, output_tokens)
+        max_tokens = budget['output_tokens']
+        if budget['stream']:
+            async with client.messages.stream(
                 model=model_name,
-                max_tokens=max_tokens,  # Use word-based estimation
+                max_tokens=max_tokens,
                 temperature=0.01,
                 system=system_prompt,
                 messages=[{"role": "user", "content": text}]
             ) as stream:
                 response_text = ""
-                for text_chunk in stream.text_stream:
+                async for text_chunk in stream.text_stream:
                     response_text += text_chunk
             logging.info(f"Claude streaming response: {response_text.strip()}")
             if run_fix:
-                output = fix_a_json_string(response_text.strip())
+                output = await fix_a_json_string(response_text.strip(), expected_keys)
             else:
                 output = response_text.strip()
             return output
         else:
-            message = client.messages.create(
+            message = await client.messages.create(
                 model=model_name,
-                max_tokens=max_tokens,  # Lower limit for fallback
+                max_tokens=max_tokens,
                 temperature=0.01,
                 system=system_prompt,
                 messages=[{"role": "user", "content": text}]
             )
             if run_fix:
                 logging.info(f"Claude response: {message.content[0].text.strip()}")
-                output = fix_a_json_string(message.content[0].text.strip())
+                output = await fix_a_json_string(message.content[0].text.strip(), expected_keys)
             else:
                 logging.info(f"Claude response: {message.content[0].text.strip()}")
                 output = message.content[0].text.strip()
             return output
 
-def analyze_with_deepseek_streaming(text, system_prompt, model_name, ):
+async def analyze_with_deepseek_streaming(text, system_prompt, model_name, output_tokens=None, expected_keys=()):
         """
         Analyze text using DeepSeek with streaming to avoid timeout issues.
         """
-        client = OpenAI(api_key=os.environ["DEEPSEEK_API_KEY"], base_url="https://api.deepseek.com")
-
-        # Use streaming by default for DeepSeek
-        # Count the number of words in the input text and system prompt
-        word_count = len((text + " " + system_prompt).split())
-        # Use a safe multiplier to estimate max_tokens (assuming ~1.3 tokens per word)
-        max_tokens = int(round(1.3 * word_count))
-        logging.info(f"Estimated max_tokens for DeepSeek: {max_tokens} (based on word count: {word_count})")
-        if max_tokens > 4096:
-            with client.chat.completions.create(
+        client = get_client('deepseek')
+
+        # Output budget from the size of the requested JSON, not the length of the paper
+        text, budget = budget_call(text, system_prompt, model_name, output_tokens)
+        max_tokens = budget['output_tokens']
+        if budget['stream']:
+            stream = await client.chat.completions.create(
                 model=model_name,
                 max_tokens=max_tokens,
                 temperature=0.01,
                 messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
                 stream=True
-            ) as stream:
+            )
+            async with stream:
                 response_text = ""
-                for chunk in stream:
+                async for chunk in stream:
                     if chunk.choices[0].delta.content:
                         text_chunk = chunk.choices[0].delta.content
                         response_text += text_chunk
             logging.info(f"DeepSeek streaming response: {response_text.strip()}")
-            output = fix_a_json_string(response_text.strip())
+            output = await fix_a_json_string(response_text.strip(), expected_keys)
             return output
         else:
-            message = client.chat.completions.create(
+            message = await client.chat.completions.create(
                 model=model_name,
                 max_tokens=max_tokens,
                 temperature=0.01,
@@ -221,39 +346,39 @@ def analyze_with_deepseek_streaming(text, system_prompt, model_name, ):
             )
             content = message.choices[0].message.content.strip()
             logging.info(f"DeepSeek streaming response: {content}")
-            output = fix_a_json_string(content)
+            output = await fix_a_json_string(content, expected_keys)
             return output
 
 
-def analyze_with_openai(text, system_prompt="You are an expert reviewer for onboarding literature for physician.", model_name="gpt-4-1106-preview"):
+async def analyze_with_openai(text, system_prompt="You are an expert reviewer for onboarding literature for physician.", model_name="gpt-4-1106-preview",
+                              output_tokens=None, expected_keys=()):
     """
     Analyze text using OpenAI's GPT model.
     """
-    client = OpenAI(api_key=os.environ["OpenAI_API_KEY"])
+    client = get_client('openai')
     
-    # Count the number of words in the input text and system prompt
-    word_count = len((text + " " + system_prompt).split())
-    # Use a safe multiplier to estimate max_tokens (assuming ~1.3 tokens per word)
-    max_tokens = int(round(1.3 * word_count))
-    logging.info(f"Estimated max_tokens for OpenAI: {max_tokens} (based on word count: {word_count})")
-    if max_tokens > 4096:
-        # Use streaming for larger inputs
-        with client.chat.completions.create(
+    # Output budget from the size of the requested JSON, not the length of the paper
+    text, budget = budget_call(text, system_prompt, model_name, output_tokens)
+    max_tokens = budget['output_tokens']
+    if budget['stream']:
+        # Use streaming for large output budgets
+        stream = await client.chat.completions.create(
             model=model_name,
-            max_completion_tokens=max_tokens,  # Use word-based estimation
+            max_completion_tokens=max_tokens,
             # temperature=0.01,
             messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
             stream=True
-        ) as stream:
+        )
+        async with stream:
             response_text = ""
-            for chunk in stream:
+            async for chunk in stream:
                 if chunk.choices[0].delta.content:
                     text_chunk = chunk.choices[0].delta.content
                     response_text += text_chunk
         logging.info(f"OpenAI streaming response: {response_text.strip()}")
-        return fix_a_json_string(response_text.strip())
+        return await fix_a_json_string(response_text.strip(), expected_keys)
     else:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=model_name,
             messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
             max_completion_tokens=max_tokens
@@ -262,31 +387,216 @@ def analyze_with_openai(text, system_prompt="You are an expert reviewer for onbo
         
         content = response.choices[0].message.content
         logging.info(f"OpenAI streaming response: {content.strip()}")
-        return fix_a_json_string(content.strip() if content else "")
+        return await fix_a_json_string(content.strip() if content else "", expected_keys)
 
-def analyze_with(text, system_prompt="You are an expert reviewer for onboarding literature for physician.", model_name="claude-3-7-sonnet-20250219"):
+async def analyze_with(text, system_prompt="You are an expert reviewer for onboarding literature for physician.", model_name="claude-3-7-sonnet-20250219",
+                       output_tokens=None):
     """
     Main analysis function that routes to appropriate AI service.
     """
+    provider = provider_of(model_name)
+    # keys of the JSON structure the system prompt (or else the user prompt) asks for
+    expected_keys = requested_keys(system_prompt, text)
     try:
-        if 'claude' in model_name.lower():
-            return analyze_with_claude_streaming(text, system_prompt, model_name)
-        elif 'deepseek' in model_name.lower():                
-            return analyze_with_deepseek_streaming(text, system_prompt, model_name)
-        else:
-            return analyze_with_openai(text, system_prompt, model_name)
+        async with provider_limit(provider):
+            if provider == 'claude':
+                return await analyze_with_claude_streaming(text, system_prompt, model_name, output_tokens=output_tokens,
+                                                           expected_keys=expected_keys)
+            elif provider == 'deepseek':
+                return await analyze_with_deepseek_streaming(text, system_prompt, model_name,
+                                                             output_tokens=output_tokens, expected_keys=expected_keys)
+            else:
+                return await analyze_with_openai(text, system_prompt, model_name, output_tokens=output_tokens,
+                                                 expected_keys=expected_keys)
     
     except Exception as e:
         logging.error(f"Error in analyze_with: {e}")
         return json.dumps({"summary": f"Error: {str(e)}", "score": 0})
 
 
+
+# --- Map-reduce analysis of long documents ---
+# Evidence is extracted from section-aware chunks concurrently (map), then one call writes the review JSON (reduce).
+ANALYSIS_MODES = ("auto", "single", "map_reduce")
+MAP_REDUCE_THRESHOLD = int(os.getenv("MAP_REDUCE_THRESHOLD", 30000))  # input tokens above which "auto" maps
+MAP_CHUNK_TOKENS = int(os.getenv("MAP_CHUNK_TOKENS", 12000))
+MAP_OUTPUT_TOKENS = int(os.getenv("MAP_OUTPUT_TOKENS", 2000))
+
+MAP_SYSTEM_PROMPT = """You extract evidence from one part of a longer document for a reviewer who will only read your notes, not the document.
+The reviewer's instructions and criteria are given for context: do not score and do not use their output format.
+Output only JSON with this structure:
+{
+    "main_points": ["point made in this part"],
+    "criteria_evidence": [
+        {"criterion_name": name, "evidence": "fact, figure or short quote from this part", "assessment": "supports a high score | supports a low score | neutral"}
+    ],
+    "strengths": ["strength shown in this part"],
+    "weaknesses": ["weakness shown in this part"]
+}
+Only report what this part actually says. Leave a list empty when this part has nothing for it."""
+
+
+def use_map_reduce(text: str, system_prompt: str, model: str, mode: str) -> bool:
+    """Whether to analyze `text` chunk by chunk: always, never, or ("auto") when it is long or overflows the window."""
+    if mode != "auto":
+        return mode == "map_reduce"
+    budget = plan(text, system_prompt, model)
+    return budget['overflow'] > 0 or budget['input_tokens'] > MAP_REDUCE_THRESHOLD
+
+
+async def extract_evidence(document: str, user_prompt: str, model: str) -> list:
+    """Map step: evidence notes for each chunk of the document, extracted concurrently within the provider limit."""
+    window, _ = model_limits(model)
+    chunk_tokens = min(MAP_CHUNK_TOKENS, (window - MAP_OUTPUT_TOKENS) // 2)
+    chunks = chunk_document(document, model, chunk_tokens)
+    logging.info(f"Map-reduce analysis: {len(chunks)} chunks of at most {chunk_tokens} tokens for {model}")
+
+    async def map_chunk(index, chunk):
+        sections = ", ".join(chunk['headings']) or "untitled"
+        text = (f"Reviewer instructions: {user_prompt or ''}\n\n"
+                f"Part {index + 1} of {len(chunks)} (sections: {sections}):\n\n{chunk['text']}")
+        answer = await analyze_with(text, system_prompt=MAP_SYSTEM_PROMPT, model_name=model,
+                                    output_tokens=MAP_OUTPUT_TOKENS)
+        try:
+            notes = json.loads(answer)
+        except (TypeError, ValueError):
+            notes = None
+        if not isinstance(notes, dict) or str(notes.get("summary", "")).startswith("Error"):
+            logging.error(f"No evidence extracted from part {index + 1}: {answer}")
+            return None
+        return {"part": index + 1, "sections": chunk['headings'], **notes}
+
+    notes = await asyncio.gather(*(map_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+    return [note for note in notes if note is not None]
+
+
+def reduce_prompt(evidence: list, user_prompt: str) -> str:
+    """Reduce step input: the user prompt followed by the evidence notes of every part, in document order."""
+    return (f"User prompt: {user_prompt or ''} \n\n"
+            f"The document was too long to read at once. Below are evidence notes extracted from each of its parts, "
+            f"in document order. Base your analysis only on these notes.\n\n"
+            f"{json.dumps(evidence, ensure_ascii=False)}")
+
+
+async def analyze_map_reduce(document: str, system_prompt: str, user_prompt: str, model: str) -> str:
+    """Review JSON of a long document, in the same format as a single analyze_with call."""
+    evidence = await extract_evidence(document, user_prompt, model)
+    if not evidence:
+        return json.dumps({"summary": "Error: no evidence could be extracted from the document", "score": 0})
+    return await analyze_with(reduce_prompt(evidence, user_prompt), system_prompt=system_prompt, model_name=model,
+                              output_tokens=expected_output_tokens(user_prompt, model))
+
+# Final results of identical requests; bump CACHE_VERSION when prompts or scoring change
+CACHE_VERSION = os.getenv("RESULT_CACHE_VERSION", "1")
+CACHE_MODES = ("use", "bypass", "refresh")
+result_cache = ResultCache()
+_inflight = {}
+
+
+def is_cacheable(result: dict) -> bool:
+    """Only real analyses are cached, not extraction failures or provider errors."""
+    try:
+        summary = json.loads(result["summary"])
+    except (TypeError, ValueError):
+        return False
+    return not (isinstance(summary, dict) and str(summary.get("summary", "")).startswith("Error"))
+
+
+def check_modes(cache: str, mode: str):
+    if cache not in CACHE_MODES:
+        raise ValueError(f"cache must be one of {', '.join(CACHE_MODES)}")
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"mode must be one of {', '.join(ANALYSIS_MODES)}")
+
+
+def result_key(pdf_sha256: str, system_prompt: str, user_prompt: str, model: str, mode: str) -> str:
+    # "auto" keeps the plain version tag, so entries cached before analysis modes existed stay valid
+    version = CACHE_VERSION if mode == "auto" else f"{CACHE_VERSION}/{mode}"
+    return ResultCache.make_key(pdf_sha256, system_prompt, user_prompt, model, version)
+
+
+async def run_analysis(data: bytes, filename: str, system_prompt: str = None, user_prompt: str = None,
+                       model: str = "claude-3-7-sonnet-20250219", cache: str = "use", mode: str = "auto") -> dict:
+    """
+    Cached front of analyze_document, shared by /analyze, batches and jobs.
+    cache="use" answers identical requests from the result cache, "refresh"
+    recomputes and overwrites the entry, "bypass" neither reads nor writes it.
+    Identical requests already in flight share one analysis.
+    """
+    check_modes(cache, mode)
+    pdf_sha256 = content_hash(data)
+    key = result_key(pdf_sha256, system_prompt, user_prompt, model, mode)
+    if cache == "use":
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            result_cache.count('hit')
+            logging.info(f"Result cache hit for {filename} with model {model}")
+            return json.loads(cached)
+        result_cache.count('miss')
+    else:
+        result_cache.count(cache)
+    shared = _inflight.get(key) if cache != "bypass" else None
+    if shared is not None:
+        logging.info(f"Joining the analysis of {filename} already in progress")
+        try:
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            if not shared.cancelled():
+                raise
+            # the request we joined was cancelled: run our own analysis
+
+    task = asyncio.ensure_future(analyze_document(data, filename, system_prompt, user_prompt, model, mode))
+    if cache != "bypass":
+        _inflight[key] = task
+    try:
+        result = await task
+    finally:
+        if _inflight.get(key) is task:
+            del _inflight[key]
+    if cache != "bypass" and is_cacheable(result):
+        await asyncio.to_thread(result_cache.put, key, pdf_sha256, model, json.dumps(result))
+    return result
+
+
+def with_user_prompt(text: str, user_prompt: str = None) -> str:
+    if user_prompt:
+        # Append user prompt to the text for analysis
+        text = f"User prompt: {user_prompt} \n\n {text}"
+    return text
+
+
+def keyword_score(text: str) -> int:
+    # Calculate simple score based on keywords
+    score = sum(keyword in text.lower() for keyword in ["onboarding", "specific", "flow", "generalist"])
+    return min(score, 5)
+
+
+async def analyze_document(data: bytes, filename: str, system_prompt: str = None, user_prompt: str = None,
+                           model: str = "claude-3-7-sonnet-20250219", mode: str = "auto") -> dict:
+    """Extract the PDF text and analyze it, in one call or map-reduce (see ANALYSIS_MODES)."""
+    document = await extract_text(data, filename)
+    text = with_user_prompt(document, user_prompt)
+    
+    if len(text) < 500:
+        return {"summary": "Text too short or not extractable.", "score": 0}
+    
+    # Analyze with selected model
+    if use_map_reduce(text, system_prompt, model, mode):
+        summary = await analyze_map_reduce(document, system_prompt, user_prompt, model)
+    else:
+        summary = await analyze_with(text, system_prompt=system_prompt, model_name=model)
+    
+    return {"summary": summary, "score": keyword_score(text)}
+
+
 @app.post("/analyze", response_model=AnalysisResult)
 async def analyze_pdf(
     file: UploadFile = File(...),
     system_prompt: str = Form(None),
     user_prompt: str = Form(None),
-    model: str = Form("claude-3-7-sonnet-20250219")
+    model: str = Form("claude-3-7-sonnet-20250219"),
+    cache: str = Form("use"),
+    mode: str = Form("auto")
 ):
     logging.info("Received request to analyze PDF")
     logging.info(f"Received file: {file.filename}")
@@ -296,24 +606,353 @@ async def analyze_pdf(
     logging.info(f"File size: {file.file.seek(0, 2)} bytes")  # Log file size
     
     try:
-        # Extract text from PDF
-        text = robust_extract_text(file)
-        
-        if user_prompt:
-            # Append user prompt to the text for analysis
-            text = f"User prompt: {user_prompt} \n\n {text}"
-        
-        if len(text) < 500:
-            return {"summary": "Text too short or not extractable.", "score": 0}
-        
-        # Analyze with selected model
-        summary = analyze_with(text, system_prompt=system_prompt, model_name=model)
-        
-        # Calculate simple score based on keywords
-        score = sum(keyword in text.lower() for keyword in ["onboarding", "specific", "flow", "generalist"])
-        
-        return {"summary": summary, "score": min(score, 5)}
+        await file.seek(0)
+        return await run_analysis(await file.read(), file.filename, system_prompt, user_prompt, model, cache, mode)
     
     except Exception as e:
         logging.error(f"Error in analyze_pdf: {e}")
         return {"summary": f"Error processing file: {str(e)}", "score": 0}
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    system_prompt: str = Form(None),
+    user_prompt: str = Form(None),
+    model: str = Form("claude-3-7-sonnet-20250219"),
+    cache: str = Form("use"),
+    mode: str = Form("auto")
+):
+    """
+    Analyze many PDFs with one shared prompt and model. Extraction runs in
+    parallel in the process pool, LLM calls run concurrently within the
+    provider limit, and one JSON line per document is streamed back as soon
+    as that document is finished (in completion order, with its `index`).
+    """
+    uploads = [(upload.filename, await upload.read()) for upload in files]
+    logging.info(f"Received batch of {len(uploads)} PDFs for model {model}")
+
+    async def analyze_one(index, filename, data):
+        try:
+            result = await run_analysis(data, filename, system_prompt, user_prompt, model, cache, mode)
+        except Exception as e:
+            logging.error(f"Error in analyze_batch for {filename}: {e}")
+            result = {"summary": f"Error processing file: {str(e)}", "score": 0}
+        return {"index": index, "filename": filename, **result}
+
+    async def results():
+        tasks = [asyncio.create_task(analyze_one(i, name, data)) for i, (name, data) in enumerate(uploads)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            # client went away: stop the documents still in flight
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def stream_with(text, system_prompt, model_name):
+    """Yield the model's answer chunk by chunk as the provider streams it."""
+    provider = provider_of(model_name)
+    system_prompt = system_prompt or ""
+    text, budget = budget_call(text, system_prompt, model_name)
+    max_tokens = budget['output_tokens']
+    messages = [{"role": "user", "content": text}]
+    async with provider_limit(provider):
+        if provider == 'claude':
+            async with get_client('claude').messages.stream(
+                model=model_name,
+                max_tokens=max_tokens,
+                temperature=0.01,
+                system=system_prompt,
+                messages=messages
+            ) as stream:
+                async for text_chunk in stream.text_stream:
+                    yield text_chunk
+            return
+        messages = [{"role": "system", "content": system_prompt}] + messages
+        if provider == 'deepseek':
+            limits = {"max_tokens": max_tokens, "temperature": 0.01}
+        else:
+            limits = {"max_completion_tokens": max_tokens}
+        stream = await get_client(provider).chat.completions.create(
+            model=model_name, messages=messages, stream=True, **limits)
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+# `"key":` of the next top-level field, after an optional comma
+FIELD_KEY_PATTERN = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"\s*:\s*')
+
+
+class PartialJSONFields:
+    """
+    Incremental reader of a streamed JSON object: feed() returns the top-level
+    fields whose values have been received completely so far.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None  # index after the last complete field, once the opening brace was seen
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.position is None:
+            start = self.buffer.find("{")
+            if start < 0:
+                return []
+            self.position = start + 1
+        fields = []
+        while True:
+            match = FIELD_KEY_PATTERN.match(self.buffer, self.position)
+            if not match:
+                return fields
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, match.end())
+            except json.JSONDecodeError:
+                return fields  # value not complete yet
+            if end >= len(self.buffer) and not isinstance(value, (dict, list, str)):
+                return fields  # a number or literal may still be growing
+            fields.append((json.loads(f'"{match.group(1)}"'), value))
+            self.position = end
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/analyze/stream")
+async def analyze_pdf_stream(
+    file: UploadFile = File(...),
+    system_prompt: str = Form(None),
+    user_prompt: str = Form(None),
+    model: str = Form("claude-3-7-sonnet-20250219"),
+    cache: str = Form("use"),
+    mode: str = Form("auto")
+):
+    """
+    Server-sent events variant of /analyze: `status` events for the stages,
+    `token` events with the raw text as it arrives, `field` events for each
+    top-level JSON field as soon as it is complete, then one `result` event
+    with the same body /analyze returns (or an `error` event).
+    """
+    try:
+        check_modes(cache, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    data = await file.read()
+    filename = file.filename
+    logging.info(f"Received streaming request for {filename} with model {model}")
+
+    async def events():
+        try:
+            pdf_sha256 = content_hash(data)
+            key = result_key(pdf_sha256, system_prompt, user_prompt, model, mode)
+            if cache == "use":
+                cached = await asyncio.to_thread(result_cache.get, key)
+                if cached is not None:
+                    result_cache.count('hit')
+                    yield sse_event("result", json.loads(cached))
+                    return
+                result_cache.count('miss')
+            else:
+                result_cache.count(cache)
+
+            yield sse_event("status", {"stage": "extracting"})
+            document = await extract_text(data, filename)
+            text = with_user_prompt(document, user_prompt)
+            if len(text) < 500:
+                yield sse_event("result", {"summary": "Text too short or not extractable.", "score": 0})
+                return
+
+            prompt = text
+            if use_map_reduce(text, system_prompt, model, mode):
+                # only the reduce step is streamed
+                yield sse_event("status", {"stage": "extracting evidence"})
+                evidence = await extract_evidence(document, user_prompt, model)
+                if not evidence:
+                    raise RuntimeError("no evidence could be extracted from the document")
+                prompt = reduce_prompt(evidence, user_prompt)
+
+            yield sse_event("status", {"stage": "analyzing"})
+            fields = PartialJSONFields()
+            response_text = ""
+            async for chunk in stream_with(prompt, system_prompt, model):
+                response_text += chunk
+                yield sse_event("token", {"text": chunk})
+                for name, value in fields.feed(chunk):
+                    yield sse_event("field", {"name": name, "value": value})
+            logging.info(f"Streamed response for {filename}: {response_text.strip()}")
+
+            summary = await fix_a_json_string(response_text.strip(), requested_keys(system_prompt, prompt))
+            result = {"summary": summary, "score": keyword_score(text)}
+            if cache != "bypass" and is_cacheable(result):
+                await asyncio.to_thread(result_cache.put, key, pdf_sha256, model, json.dumps(result))
+            yield sse_event("result", result)
+        except Exception as e:
+            logging.error(f"Error in analyze_pdf_stream: {e}")
+            yield sse_event("error", {"summary": f"Error processing file: {str(e)}", "score": 0})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate and size of the result cache (counted across all workers, as of their last cache write)."""
+    return {**await asyncio.to_thread(result_cache.stats), "version": CACHE_VERSION}
+
+
+@app.get("/repair/stats")
+async def repair_stats():
+    """How model answers were made valid JSON by this worker: as is, locally, by the LLM, or not at all."""
+    return json_repair_stats
+
+
+# --- Asynchronous jobs: submit, poll, cancel ---
+# A bounded number of workers drain the persisted queue; the HTTP requests return immediately.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Each server process marks its running jobs alive; jobs of processes that died are requeued
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 10))
+# Pause after a job store error (e.g. a locked database) before a loop tries again
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 2))
+job_store = JobStore()
+_job_wakeup = asyncio.Event()
+_job_workers = []
+_running_jobs = {}
+
+
+async def job_heartbeat():
+    """Keep this process's running jobs alive, stop those cancelled from another process, requeue orphans."""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            for job_id in await asyncio.to_thread(job_store.heartbeat):
+                if job_id in _running_jobs:
+                    _running_jobs[job_id].cancel()
+            requeued = await asyncio.to_thread(job_store.requeue_stale)
+            if requeued:
+                logging.info(f"Requeued {requeued} job(s) of a server process that stopped")
+                _job_wakeup.set()
+        except Exception as e:
+            # a missed beat is harmless; a dead heartbeat task would get running jobs requeued
+            logging.error(f"Job heartbeat failed: {e}")
+
+
+async def finish_job(job_id: str, finish, *args):
+    """Record a job's outcome, retrying while the job database is busy."""
+    for attempt in range(3):
+        try:
+            return await asyncio.to_thread(finish, job_id, *args)
+        except sqlite3.OperationalError as e:
+            logging.error(f"Could not record the outcome of job {job_id}: {e}")
+            await asyncio.sleep(JOB_RETRY_DELAY * (attempt + 1))
+    # still held by this process: released to the queue at shutdown, or requeued if this process dies
+    return False
+
+
+async def run_next_job(worker_id: int):
+    """Claim the next queued job and run it; waits for new work when the queue is empty."""
+    claimed = await asyncio.to_thread(job_store.claim_next)
+    if claimed is None:
+        _job_wakeup.clear()
+        try:
+            await asyncio.wait_for(_job_wakeup.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            pass
+        return
+    job_id, filename, params, data = claimed
+    logging.info(f"Job worker {worker_id} started job {job_id} ({filename})")
+    task = asyncio.create_task(run_analysis(data, filename, **params))
+    _running_jobs[job_id] = task
+    try:
+        await finish_job(job_id, job_store.complete, await task)
+        logging.info(f"Job {job_id} finished")
+    except asyncio.CancelledError:
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None or job["status"] != 'cancelled':
+            raise  # the worker itself is shutting down; the job is released back to the queue
+        logging.info(f"Job {job_id} cancelled")
+    except Exception as e:
+        logging.error(f"Job {job_id} failed: {e}")
+        await finish_job(job_id, job_store.fail, str(e))
+    finally:
+        _running_jobs.pop(job_id, None)
+
+
+async def job_worker(worker_id: int):
+    """Run queued jobs one at a time until the server stops."""
+    while True:
+        try:
+            await run_next_job(worker_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Job worker {worker_id} error: {e}")
+            await asyncio.sleep(JOB_RETRY_DELAY)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    requeued = await asyncio.to_thread(job_store.requeue_stale)
+    if requeued:
+        logging.info(f"Requeued {requeued} job(s) interrupted by the last shutdown")
+    _job_workers.extend(asyncio.create_task(job_worker(i)) for i in range(JOB_WORKERS))
+    _job_workers.append(asyncio.create_task(job_heartbeat()))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop and release the jobs first, so they are requeued rather than failed by the closing clients and pool."""
+    for worker in _job_workers:
+        worker.cancel()
+    await asyncio.gather(*_job_workers, return_exceptions=True)
+    # only this process's jobs: the other workers are still running theirs
+    await asyncio.to_thread(job_store.release)
+    await shutdown_workers()
+
+
+@app.post("/jobs")
+async def create_job(
+    file: UploadFile = File(...),
+    system_prompt: str = Form(None),
+    user_prompt: str = Form(None),
+    model: str = Form("claude-3-7-sonnet-20250219"),
+    priority: int = Form(0),
+    cache: str = Form("use"),
+    mode: str = Form("auto")
+):
+    """Queue an analysis and return its id right away; higher priority runs first."""
+    try:
+        check_modes(cache, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    params = {"system_prompt": system_prompt, "user_prompt": user_prompt, "model": model, "cache": cache,
+              "mode": mode}
+    job_id = await asyncio.to_thread(job_store.create, await file.read(), file.filename, params, priority)
+    logging.info(f"Queued job {job_id} for {file.filename} with model {model} (priority {priority})")
+    _job_wakeup.set()
+    return await asyncio.to_thread(job_store.get, job_id)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job; finished jobs are left as they are."""
+    if await asyncio.to_thread(job_store.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if await asyncio.to_thread(job_store.cancel, job_id) and job_id in _running_jobs:
+        _running_jobs[job_id].cancel()
+    return await asyncio.to_thread(job_store.get, job_id)
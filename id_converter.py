@@ -0,0 +1,146 @@
+"""
+PMID -> PMCID / DOI resolution for the pipeline stages.
+
+Identifiers are looked up in batches of up to 200 through the NCBI PMC ID
+converter and kept in a local SQLite cache (id_cache.db by default) that
+stage 01 seeds with the IDs it already gets from PubMed, and that stages 03
+and 05 read before asking NCBI. PMIDs the converter had no PMCID for are
+asked again once their answer is older than ID_CACHE_TTL_DAYS (30 by
+default), since embargoed articles reach PMC later.
+"""
+import os
+import sqlite3
+import time
+
+import requests
+
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+BATCH_SIZE = 200  # maximum number of IDs the converter accepts per request
+DEFAULT_CACHE = os.getenv("ID_CACHE_DB", "id_cache.db")
+DEFAULT_TTL_DAYS = float(os.getenv("ID_CACHE_TTL_DAYS", 30))
+
+
+class IdCache:
+    """Local PMID -> PMCID/DOI mapping."""
+
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ids (
+                pmid TEXT PRIMARY KEY,
+                pmcid TEXT,
+                doi TEXT,
+                source TEXT,
+                resolved_at REAL,
+                checked_at REAL
+            )
+        ''')
+        if 'checked_at' not in [row[1] for row in self.conn.execute("PRAGMA table_info(ids)")]:
+            # caches created before converter answers were dated separately
+            self.conn.execute("ALTER TABLE ids ADD COLUMN checked_at REAL")
+            self.conn.execute("UPDATE ids SET checked_at = resolved_at WHERE source = 'idconv'")
+        self.conn.commit()
+
+    def get(self, pmids):
+        """Return {pmid: {'pmid', 'pmc', 'doi'}} for the PMIDs already in the cache."""
+        found = {}
+        pmids = [str(p) for p in pmids]
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for pmid, pmcid, doi in self.conn.execute(
+                    f"SELECT pmid, pmcid, doi FROM ids WHERE pmid IN ({placeholders})", chunk):
+                found[pmid] = {'pmid': pmid, 'pmc': pmcid or '', 'doi': doi or ''}
+        return found
+
+    def needs_lookup(self, pmids, ttl_days=DEFAULT_TTL_DAYS):
+        """PMIDs without a cached PMCID that the converter was never asked about, or not within ttl_days."""
+        pmids = [str(p) for p in pmids]
+        settled = set()
+        cutoff = time.time() - ttl_days * 86400
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            settled.update(pmid for (pmid,) in self.conn.execute(
+                f"SELECT pmid FROM ids WHERE pmid IN ({placeholders}) "
+                f"AND (pmcid IS NOT NULL OR checked_at >= ?)", chunk + [cutoff]))
+        return [p for p in pmids if p not in settled]
+
+    def store(self, records, source):
+        """Insert or complete cache entries; known identifiers are never overwritten with blanks."""
+        now = time.time()
+        checked_at = now if source == "idconv" else None
+        rows = [(str(r['pmid']), r.get('pmc') or None, r.get('doi') or None, source, now, checked_at)
+                for r in records if r.get('pmid')]
+        self.conn.executemany('''
+            INSERT INTO ids (pmid, pmcid, doi, source, resolved_at, checked_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(pmid) DO UPDATE SET
+                pmcid = COALESCE(excluded.pmcid, ids.pmcid),
+                doi = COALESCE(excluded.doi, ids.doi),
+                source = excluded.source,
+                resolved_at = excluded.resolved_at,
+                checked_at = COALESCE(excluded.checked_at, ids.checked_at)
+        ''', rows)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def convert_batch(pmids, email=None, tool="review_onboarding_anesthesia", timeout=30):
+    """Ask the NCBI ID converter about up to BATCH_SIZE PMIDs in one request."""
+    params = {
+        "ids": ",".join(str(p) for p in pmids),
+        "idtype": "pmid",
+        "format": "json",
+        "tool": tool,
+    }
+    email = email or os.getenv("ENTREZ_EMAIL")
+    if email:
+        params["email"] = email
+    response = requests.get(IDCONV_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    records = []
+    for record in response.json().get("records", []):
+        # articles unknown to PMC come back with status "error" and no identifiers
+        records.append({
+            'pmid': str(record.get('pmid') or record.get('requested-id', '')),
+            'pmc': record.get('pmcid', ''),
+            'doi': record.get('doi', ''),
+        })
+    return records
+
+
+def resolve_ids(pmids, cache=None, email=None, delay=0.34, ttl_days=DEFAULT_TTL_DAYS):
+    """
+    Return {pmid: {'pmid', 'pmc', 'doi'}} for every PMID.
+    Cached PMIDs are answered locally; the rest are sent to the converter in
+    batches of BATCH_SIZE (spaced by `delay` to respect NCBI rate limits)
+    and stored in the cache, including the ones PMC does not know. Those are
+    asked again after `ttl_days`.
+    """
+    own_cache = cache is None
+    if own_cache:
+        cache = IdCache()
+    try:
+        pmids = list(dict.fromkeys(str(p) for p in pmids if p))
+        resolved = cache.get(pmids)
+        missing = cache.needs_lookup(pmids, ttl_days)
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            try:
+                records = convert_batch(batch, email=email)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"ID converter request failed for {len(batch)} PMIDs: {e}")
+                continue
+            by_pmid = {r['pmid']: r for r in records}
+            records = [by_pmid.get(p, {'pmid': p, 'pmc': '', 'doi': ''}) for p in batch]
+            cache.store(records, source="idconv")
+            resolved.update(cache.get(batch))
+            if start + BATCH_SIZE < len(missing):
+                time.sleep(delay)
+        return resolved
+    finally:
+        if own_cache:
+            cache.close()
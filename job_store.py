@@ -0,0 +1,178 @@
+"""
+Persistent state of the analysis jobs served by app.py.
+
+Jobs live in a SQLite table (jobs.db by default) and their uploaded PDFs in a
+folder next to it, so queued work and finished results survive server and
+client restarts. Jobs are claimed highest priority first, then oldest first.
+
+Several server processes can share one store: a claim is a conditional
+UPDATE, so each job runs once, and every running job records the process
+that owns it and a heartbeat. Only jobs whose owner stopped sending
+heartbeats are put back in the queue.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_DB = os.getenv("JOBS_DB", "jobs.db")
+DEFAULT_UPLOAD_DIR = os.getenv("JOBS_UPLOAD_DIR", "job_uploads")
+# A running job whose owner has not sent a heartbeat for this long is requeued
+DEFAULT_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 60))
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class JobStore:
+    """Queued, running and finished analysis jobs."""
+
+    def __init__(self, path=DEFAULT_DB, upload_dir=DEFAULT_UPLOAD_DIR):
+        self.upload_dir = upload_dir
+        # identifies this process as the owner of the jobs it claims
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        os.makedirs(upload_dir, exist_ok=True)
+        # the server calls the store from worker threads, one statement group at a time
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'queued',
+                priority INTEGER NOT NULL DEFAULT 0,
+                filename TEXT,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                heartbeat REAL
+            )
+        ''')
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+            if column not in columns:
+                # stores created before jobs had owners
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+        self.conn.commit()
+
+    def upload_path(self, job_id):
+        return os.path.join(self.upload_dir, f"{job_id}.pdf")
+
+    def create(self, data, filename, params, priority=0):
+        """Store the upload and queue a job for it; returns the job id."""
+        job_id = uuid.uuid4().hex
+        with open(self.upload_path(job_id), 'wb') as f:
+            f.write(data)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, priority, filename, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, priority, filename, json.dumps(params), time.time()))
+            self.conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        """Public view of a job (without its parameters), or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = {
+                "job_id": row["id"],
+                "status": row["status"],
+                "priority": row["priority"],
+                "filename": row["filename"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+                "error": row["error"],
+                "created_at": row["created_at"],
+                "started_at": row["started_at"],
+                "finished_at": row["finished_at"],
+            }
+            if row["status"] == 'queued':
+                job["queue_position"] = self.conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                    "(priority > ? OR (priority = ? AND created_at < ?))",
+                    (row["priority"], row["priority"], row["created_at"])).fetchone()[0]
+            return job
+
+    def claim_next(self):
+        """
+        Mark the next queued job as running for this process and return
+        (id, filename, params, upload bytes), or None. A job claimed by
+        another process in the meantime is skipped.
+        """
+        with self.lock:
+            while True:
+                row = self.conn.execute(
+                    "SELECT id, filename, params FROM jobs WHERE status = 'queued' "
+                    "ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                with self.conn:
+                    claimed = self.conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, heartbeat = ? "
+                        "WHERE id = ? AND status = 'queued'", (now, self.owner, now, row["id"])).rowcount
+                if claimed:
+                    break
+            with open(self.upload_path(row["id"]), 'rb') as f:
+                data = f.read()
+            return row["id"], row["filename"], json.loads(row["params"]), data
+
+    def _finish(self, job_id, status, result=None, error=None, owner=None):
+        # with an owner, only while that process still holds the job (it may have been requeued)
+        with self.lock:
+            with self.conn:
+                updated = self.conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                    "WHERE id = ? AND status NOT IN ('done', 'failed', 'cancelled') AND (? IS NULL OR owner = ?)",
+                    (status, json.dumps(result) if result is not None else None, error, time.time(), job_id,
+                     owner, owner)).rowcount
+            if updated and os.path.exists(self.upload_path(job_id)):
+                os.remove(self.upload_path(job_id))
+            return bool(updated)
+
+    def heartbeat(self):
+        """Mark the jobs this process is running as alive; returns the ids of those cancelled meanwhile."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'",
+                                  (time.time(), self.owner))
+            return [row["id"] for row in self.conn.execute(
+                "SELECT id FROM jobs WHERE owner = ? AND status = 'cancelled'", (self.owner,))]
+
+    def complete(self, job_id, result):
+        return self._finish(job_id, 'done', result=result, owner=self.owner)
+
+    def fail(self, job_id, error):
+        return self._finish(job_id, 'failed', error=error, owner=self.owner)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False when it had already finished."""
+        return self._finish(job_id, 'cancelled')
+
+    def requeue_stale(self, stale_after=DEFAULT_STALE_AFTER):
+        """Put running jobs whose owner stopped sending heartbeats (a crashed or killed process) back in the queue."""
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, heartbeat = NULL "
+                    "WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+                    (time.time() - stale_after,)).rowcount
+
+    def release(self):
+        """Put the jobs this process was running back in the queue, when it shuts down."""
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, heartbeat = NULL "
+                    "WHERE status = 'running' AND owner = ?", (self.owner,)).rowcount
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,215 @@
+"""
+Deterministic repair of malformed JSON returned by the LLMs.
+
+repair_json() parses model output with a tolerant recursive-descent parser
+instead of json.loads, and re-serializes whatever it recovered. It copes with
+prose or code fences around the JSON, single-quoted keys and strings,
+unquoted keys, unescaped quotes inside strings, trailing or missing commas
+(also between members, as in {"a": "x" "b": "y"}), Python literals
+(True/False/None) and output truncated in the middle of a string, array or
+object.
+
+A repair can still lose content, so callers check it against the keys the
+prompt asked for (requested_keys) before trusting it.
+"""
+import json
+import re
+
+NUMBER_PATTERN = re.compile(r'-?\d+(\.\d+)?([eE][+-]?\d+)?')
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+BARE_KEY_PATTERN = re.compile(r'[A-Za-z_][\w-]*\s*:')
+# characters that can follow the closing quote of a string
+AFTER_STRING = ',:}]'
+# whitespace then the next "key": a closing quote with the comma missing after it
+NEXT_KEY_PATTERN = re.compile(r'\s+(["\'])[^"\'\n]{1,100}\1\s*:')
+# "... with this structure: {...}" in the prompts
+STRUCTURE_PATTERN = re.compile(r'structure:\s*(?=\{)')
+
+
+class _TolerantParser:
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def at_end(self):
+        return self.pos >= len(self.text)
+
+    def skip_whitespace(self):
+        while self.pos < len(self.text):
+            if self.text[self.pos].isspace():
+                self.pos += 1
+            elif self.text.startswith('//', self.pos):
+                end = self.text.find('\n', self.pos)
+                self.pos = len(self.text) if end < 0 else end
+            else:
+                break
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.text[self.pos] if self.pos < len(self.text) else ''
+
+    def parse_value(self):
+        char = self.peek()
+        if char == '{':
+            return self.parse_object()
+        if char == '[':
+            return self.parse_array()
+        if char in '"\'':
+            return self.parse_string()
+        match = NUMBER_PATTERN.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group(0)
+            return float(number) if match.group(1) or match.group(2) else int(number)
+        return self.parse_bare_word()
+
+    def parse_object(self):
+        self.pos += 1  # '{'
+        result = {}
+        while True:
+            char = self.peek()
+            if not char:
+                return result  # truncated
+            if char == '}':
+                self.pos += 1
+                return result
+            if char == ',':
+                self.pos += 1
+                continue
+            key = self.parse_string() if char in '"\'' else self.parse_bare_word(stop=':,}')
+            if self.peek() == ':':
+                self.pos += 1
+            if self.peek() in ('', ',', '}'):
+                if not self.at_end() and self.peek() != '}':
+                    result[str(key)] = None
+                continue  # no value (truncated or missing): drop the dangling key at the end
+            result[str(key)] = self.parse_value()
+
+    def parse_array(self):
+        self.pos += 1  # '['
+        result = []
+        while True:
+            char = self.peek()
+            if not char:
+                return result  # truncated
+            if char == ']':
+                self.pos += 1
+                return result
+            if char == ',':
+                self.pos += 1
+                continue
+            if char == '}':
+                self.pos += 1  # stray closing brace inside an array
+                continue
+            result.append(self.parse_value())
+
+    def closes_string(self, index, quote):
+        """Whether the quote at `index` ends the string, rather than being an unescaped quote inside it."""
+        rest = self.text[index + 1:].lstrip()
+        if not rest or NEXT_KEY_PATTERN.match(self.text, index + 1):
+            return True
+        if rest[0] not in AFTER_STRING:
+            return False
+        if rest[0] == ',':
+            # a real closing quote is followed by the next key or value
+            following = rest[1:].lstrip()
+            return (not following or following[0] in '"\'{[]}-' or following[0].isdigit()
+                    or following.startswith(tuple(LITERALS)) or BARE_KEY_PATTERN.match(following) is not None)
+        return True
+
+    def parse_string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        chars = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            if char == '\\' and self.pos + 1 < len(self.text):
+                try:
+                    chars.append(json.loads(f'"{self.text[self.pos:self.pos + 2]}"'))
+                    self.pos += 2
+                except json.JSONDecodeError:
+                    if self.text[self.pos + 1] == 'u':
+                        try:
+                            chars.append(json.loads(f'"{self.text[self.pos:self.pos + 6]}"'))
+                            self.pos += 6
+                            continue
+                        except json.JSONDecodeError:
+                            pass
+                    chars.append(self.text[self.pos + 1])  # \' and other needless escapes
+                    self.pos += 2
+                continue
+            if char == quote and self.closes_string(self.pos, quote):
+                self.pos += 1
+                return ''.join(chars)
+            chars.append(char)
+            self.pos += 1
+        return ''.join(chars)  # truncated inside the string
+
+    def parse_bare_word(self, stop=',}]'):
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] not in stop and self.text[self.pos] != '\n':
+            self.pos += 1
+        word = self.text[start:self.pos].strip()
+        if not word and self.pos < len(self.text) and self.text[self.pos] == '\n':
+            self.pos += 1
+        return LITERALS.get(word, word)
+
+
+def find_json_start(text):
+    """Index of the first '{' or '[' (skipping prose and code fences), or -1."""
+    text_start = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    return min(text_start) if text_start else -1
+
+
+def repair_json(text):
+    """
+    Best-effort valid JSON text for `text`, or None when no object or array
+    can be recovered from it.
+    """
+    if not text:
+        return None
+    try:
+        json.loads(text)
+        return text
+    except json.JSONDecodeError:
+        pass
+    start = find_json_start(text)
+    if start < 0:
+        return None
+    try:
+        value = _TolerantParser(text[start:]).parse_value()
+    except RecursionError:
+        return None
+    if not isinstance(value, (dict, list)):
+        return None
+    return json.dumps(value, ensure_ascii=False)
+
+
+def requested_keys(*prompts):
+    """
+    Top-level keys of the JSON structure asked for by the first prompt that
+    has one ("... with this structure: {...}"), or () when none does.
+    """
+    for prompt in prompts:
+        match = STRUCTURE_PATTERN.search(prompt or '')
+        if not match:
+            continue
+        try:
+            template = _TolerantParser(prompt[match.end():]).parse_value()
+        except RecursionError:
+            continue
+        if isinstance(template, dict):
+            return tuple(template)
+    return ()
+
+
+def has_keys(json_text, keys):
+    """Whether `json_text` is a JSON object with all of `keys` (any JSON when `keys` is empty)."""
+    try:
+        value = json.loads(json_text)
+    except (TypeError, ValueError):
+        return False
+    if not keys:
+        return True
+    return isinstance(value, dict) and all(key in value for key in keys)
@@ -0,0 +1,110 @@
+"""
+Local index of the PMC Open Access file list.
+
+The OA file list (oa_file_list.csv, one row per OA package) is loaded into a
+SQLite table keyed by PMCID, so stage 03 can locate an article's package
+without calling the oa.fcgi API. The index is only rebuilt on demand
+(`python oa_index.py` or `--refresh_oa_index` in stage 03); `source` may also
+be a local copy of the CSV.
+"""
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+OA_FILE_LIST_URL = "https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_file_list.csv"
+OA_BASE_URL = "https://ftp.ncbi.nlm.nih.gov/pub/pmc/"
+DEFAULT_INDEX = os.getenv("OA_INDEX_DB", "oa_index.db")
+INSERT_BATCH = 50000
+
+
+class OAIndex:
+    """PMCID -> OA package lookup backed by SQLite."""
+
+    def __init__(self, path=DEFAULT_INDEX):
+        self.path = path
+        self.lock = threading.Lock()  # stage 03 looks packages up from its resolver threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS packages (
+                pmcid TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                pmid TEXT,
+                license TEXT,
+                last_updated TEXT
+            )
+        ''')
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+
+    def built_at(self):
+        """Time of the last refresh, or None when the index has never been built."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def is_built(self):
+        return self.built_at() is not None
+
+    def refresh(self, source=OA_FILE_LIST_URL):
+        """Rebuild the index from the OA file list (URL or local CSV path); returns the row count."""
+        if os.path.exists(source):
+            handle = open(source, newline='', encoding='utf-8')
+        else:
+            response = requests.get(source, stream=True, timeout=60)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            handle = io.TextIOWrapper(response.raw, encoding='utf-8', newline='')
+        count = 0
+        try:
+            reader = csv.DictReader(handle)
+            with self.conn:
+                self.conn.execute("DELETE FROM packages")
+                batch = []
+                for row in reader:
+                    pmcid = (row.get('Accession ID') or '').strip()
+                    if not pmcid:
+                        continue
+                    batch.append((pmcid, row['File'].strip(), (row.get('PMID') or '').strip() or None,
+                                  row.get('License'), row.get('Last Updated (YYYY-MM-DD HH:MM:SS)')))
+                    if len(batch) >= INSERT_BATCH:
+                        self.conn.executemany("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)", batch)
+                        count += len(batch)
+                        batch = []
+                self.conn.executemany("INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?)", batch)
+                count += len(batch)
+                self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                      [('built_at', str(time.time())), ('source', source)])
+        finally:
+            handle.close()
+        return count
+
+    def package_url(self, pmcid):
+        """Download URL of the article's OA package, or None when it is not in the OA subset."""
+        pmcid = str(pmcid).strip()
+        if pmcid and not pmcid.upper().startswith('PMC'):
+            pmcid = f"PMC{pmcid}"
+        with self.lock:
+            row = self.conn.execute("SELECT file FROM packages WHERE pmcid = ?", (pmcid,)).fetchone()
+        return OA_BASE_URL + row[0] if row else None
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local PMC OA file-list index")
+    parser.add_argument('--db', type=str, default=DEFAULT_INDEX, help='SQLite index to (re)build')
+    parser.add_argument('--source', type=str, default=OA_FILE_LIST_URL, help='URL or local path of oa_file_list.csv')
+    args = parser.parse_args()
+    index = OAIndex(args.db)
+    try:
+        started = time.time()
+        rows = index.refresh(args.source)
+        print(f"Indexed {rows} OA packages in {time.time() - started:.1f}s -> {args.db}")
+    finally:
+        index.close()
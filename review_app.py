@@ -7,6 +7,7 @@ import pandas as pd
 import time
 import logging
 import uuid
+import hashlib
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
@@ -102,6 +103,10 @@ st.markdown("""
 
 # --- Configuration ---
 API_URL = "http://localhost:8000/analyze"  # Update with your API URL
+JOBS_URL = API_URL.rsplit("/analyze", 1)[0] + "/jobs"  # asynchronous job API of the same server
+JOB_POLL_INTERVAL = 2  # seconds between job status checks
+JOB_MAX_WAIT = 3600  # give up waiting on a job after this many seconds
+STREAM_URL = API_URL + "/stream"  # server-sent events variant of /analyze
 
 # --- Session State Initialization ---
 def init_session_state():
@@ -121,7 +126,11 @@ def init_session_state():
         "show_prompt_modal": False,
         "analysis_depth": "Standard",
         "document_type": "Research Paper",
-        "session_id": str(uuid.uuid4())  # Generate unique session ID
+        "session_id": str(uuid.uuid4()),  # Generate unique session ID
+        "pending_jobs": {},  # job key (file name + request hash) -> server job id, so a rerun resumes polling instead of resubmitting
+        "result_cache_mode": "use",
+        "analysis_mode": "auto",
+        "stream_results": False
     }
     
     for key, value in defaults.items():
@@ -1159,9 +1168,88 @@ Do not include any additional text outside of the JSON structure nor mark json a
     log_event(f"Generated prompt for domain '{domain}' with depth '{analysis_depth}': {prompt}...")
     return prompt
 
+def job_key(pdf_name: str, files: Dict, data: Dict) -> str:
+    """Identify a job by file name, file content and request parameters (prompts, model, cache, mode)"""
+    digest = hashlib.sha256(files["file"][1].getvalue())
+    digest.update(json.dumps(data, sort_keys=True).encode("utf-8"))
+    return f"{pdf_name}:{digest.hexdigest()}"
+
+def run_analysis_job(pdf_name: str, files: Dict, data: Dict) -> Dict:
+    """Submit the analysis as a server-side job and poll it until it has finished"""
+    key = job_key(pdf_name, files, data)
+    job_id = st.session_state.pending_jobs.get(key)
+    if job_id is None:
+        # a job for this file with other settings is no longer wanted
+        for stale_key in [k for k in st.session_state.pending_jobs if k.rsplit(":", 1)[0] == pdf_name]:
+            requests.delete(f"{JOBS_URL}/{st.session_state.pending_jobs.pop(stale_key)}", timeout=30)
+        response = requests.post(JOBS_URL, files=files, data=data, timeout=120)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        st.session_state.pending_jobs[key] = job_id
+        log_event(f"Submitted job {job_id} for {pdf_name}")
+    else:
+        log_event(f"Resuming job {job_id} for {pdf_name}")
+
+    deadline = time.time() + JOB_MAX_WAIT
+    while True:
+        response = requests.get(f"{JOBS_URL}/{job_id}", timeout=30)
+        if response.status_code == 404:
+            # the server lost the job: forget it so the next attempt resubmits
+            st.session_state.pending_jobs.pop(key, None)
+            raise RuntimeError(f"Job {job_id} is unknown to the server")
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("done", "failed", "cancelled"):
+            st.session_state.pending_jobs.pop(key, None)
+            break
+        if time.time() > deadline:
+            requests.delete(f"{JOBS_URL}/{job_id}", timeout=30)
+            st.session_state.pending_jobs.pop(key, None)
+            raise TimeoutError(f"Job {job_id} did not finish within {JOB_MAX_WAIT} seconds")
+        time.sleep(JOB_POLL_INTERVAL)
+
+    if job["status"] != "done":
+        raise RuntimeError(f"Job {job_id} {job['status']}: {job.get('error') or 'no result'}")
+    return job["result"]
+
+
+def stream_analysis(pdf_name: str, files: Dict, data: Dict) -> Dict:
+    """Run the analysis over server-sent events, showing fields as soon as the model has written them"""
+    live = st.container()
+    status = live.empty()
+    fields_area = live.empty()
+    fields = {}
+    status.info(f"⏳ {pdf_name}: uploading...")
+    with requests.post(STREAM_URL, files=files, data=data, stream=True, timeout=(30, 600)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                payload = json.loads(line[len("data:"):].strip())
+                if event == "status":
+                    status.info(f"⏳ {pdf_name}: {payload['stage']}...")
+                elif event == "field":
+                    fields[payload["name"]] = payload["value"]
+                    with fields_area.container():
+                        for name, value in fields.items():
+                            st.markdown(f"**{name.replace('_', ' ').title()}**")
+                            if isinstance(value, (dict, list)):
+                                st.json(value, expanded=False)
+                            else:
+                                st.write(value)
+                elif event == "result":
+                    live.empty()
+                    return payload
+                elif event == "error":
+                    live.empty()
+                    raise RuntimeError(payload.get("summary", "Streaming analysis failed"))
+    raise RuntimeError("The stream ended without a result")
+
+
 def analyze_document(pdf_file, selected_criteria: List[str]) -> Dict:
     """Analyze a single document"""
-    response = None
     try:
         # Generate prompt
         prompt = generate_analysis_prompt(selected_criteria, st.session_state.domain, st.session_state.analysis_depth)
@@ -1171,19 +1259,21 @@ def analyze_document(pdf_file, selected_criteria: List[str]) -> Dict:
         data = {
             "system_prompt": st.session_state.system_prompt,
             "user_prompt": prompt,
-            "model": st.session_state.model
+            "model": st.session_state.model,
+            "cache": st.session_state.result_cache_mode,
+            "mode": st.session_state.analysis_mode
         }
         
         # Make API call
         # calculate the time laps for the following functiion
         log_event(f"1 | Sending API request for {pdf_file.name} with model {st.session_state.model}...")
         start_time = time.time()
-        response = requests.post(API_URL, files=files, data=data, timeout=3600) #3600
+        if st.session_state.stream_results:
+            api_data = stream_analysis(pdf_file.name, files, data)
+        else:
+            api_data = run_analysis_job(pdf_file.name, files, data)
         elapsed_time = time.time() - start_time
         log_event(f"1 | API request completed for {pdf_file.name} in {elapsed_time:.2f} seconds")
-        response.raise_for_status()
-        
-        api_data = response.json()
         log_event(f"3 | API response received for {pdf_file.name}: {api_data}")  # Log first 100 chars
         text = api_data.get("summary", api_data)
 
@@ -1221,7 +1311,7 @@ def analyze_document(pdf_file, selected_criteria: List[str]) -> Dict:
             
     except Exception as e: 
         # Return error result
-        log_event(f"error in parsing the json {response.json()}", level="error")
+        log_event(f"error in analyzing {pdf_file.name}: {e}", level="error")
         return {
             "filename": pdf_file.name,
             "reviewer": st.session_state.reviewer_name,
@@ -1260,6 +1350,28 @@ def render_main_interface():
             if st.button("🎨 Edit Prompts", use_container_width=True):
                 st.session_state.current_page = "prompts"
                 st.rerun()
+        st.session_state.result_cache_mode = st.radio(
+            "Result Cache",
+            ["use", "refresh", "bypass"],
+            index=["use", "refresh", "bypass"].index(st.session_state.result_cache_mode),
+            horizontal=True,
+            help="use: identical requests are answered from the server cache; refresh: re-run and update it; bypass: re-run without touching it",
+            key="main_result_cache_mode"
+        )
+        st.session_state.analysis_mode = st.radio(
+            "Long Documents",
+            ["auto", "single", "map_reduce"],
+            index=["auto", "single", "map_reduce"].index(st.session_state.analysis_mode),
+            horizontal=True,
+            help="auto: documents too long for one call are read section by section and the evidence combined; single: always one call; map_reduce: always section by section",
+            key="main_analysis_mode"
+        )
+        st.session_state.stream_results = st.checkbox(
+            "⚡ Show results live while the model writes them",
+            value=st.session_state.stream_results,
+            help="Streams the answer over one open connection instead of running it as a background job",
+            key="main_stream_results"
+        )
         st.markdown("---")
     
     # File Upload
@@ -0,0 +1,74 @@
+"""
+Tests of json_repair.py; run with `python -m pytest test_json_repair.py`
+or `python -m unittest test_json_repair`.
+"""
+import json
+import unittest
+
+from json_repair import has_keys, repair_json, requested_keys
+
+REVIEW_PROMPT = """Output your analysis only in JSON format with this structure:
+{
+    "filename": "document_name",
+    "summary": "document_summary",
+    "overall_score": overall_numeric_score,
+    "criteria_scores": [
+        {"criterion_name": name ,"score": score, "justification": justify your score}
+        ...
+        ],
+    "strengths": ["strength1", "strength2"]
+}
+Follow this format strictly and ensure all fields are included."""
+
+
+class RepairJsonTest(unittest.TestCase):
+
+    def repaired(self, text):
+        return json.loads(repair_json(text))
+
+    def test_valid_json_is_unchanged(self):
+        self.assertEqual(repair_json('{"a": [1, 2]}'), '{"a": [1, 2]}')
+
+    def test_missing_comma_between_members(self):
+        self.assertEqual(self.repaired('{"k": "v" "k2": "v2"}'), {"k": "v", "k2": "v2"})
+        self.assertEqual(self.repaired('{"k": "v"\n  "k2": ["a"]\n  "k3": 1}'), {"k": "v", "k2": ["a"], "k3": 1})
+
+    def test_unescaped_inner_quotes(self):
+        self.assertEqual(self.repaired('{"k": "he said "hi" to me", "k2": 1}'), {"k": 'he said "hi" to me', "k2": 1})
+
+    def test_trailing_comma_and_truncation(self):
+        self.assertEqual(self.repaired('{"a": [1, 2,], }'), {"a": [1, 2]})
+        self.assertEqual(self.repaired('Here it is: {"a": "trunc'), {"a": "trunc"})
+
+    def test_nothing_to_recover(self):
+        self.assertIsNone(repair_json('no json here'))
+
+
+class ExpectedKeysTest(unittest.TestCase):
+
+    def test_requested_keys_of_the_prompt_structure(self):
+        self.assertEqual(requested_keys(REVIEW_PROMPT),
+                         ('filename', 'summary', 'overall_score', 'criteria_scores', 'strengths'))
+
+    def test_first_prompt_with_a_structure_wins(self):
+        self.assertEqual(requested_keys('You are a reviewer.', 'with this structure: {"a": 1}'), ('a',))
+        self.assertEqual(requested_keys('You are a reviewer.', None), ())
+
+    def test_salvage_missing_expected_keys_is_rejected(self):
+        # the answer breaks off before criteria_scores: valid JSON, but not the review that was asked for
+        salvage = repair_json('{"filename": "a.pdf", "summary": "Good paper", "overall_score": 7, "crit')
+        self.assertIsNotNone(salvage)
+        self.assertFalse(has_keys(salvage, requested_keys(REVIEW_PROMPT)))
+
+    def test_complete_repair_is_accepted(self):
+        repaired = repair_json('{"filename": "a.pdf" "summary": "ok", "overall_score": 7, '
+                               '"criteria_scores": [], "strengths": [],}')
+        self.assertTrue(has_keys(repaired, requested_keys(REVIEW_PROMPT)))
+
+    def test_no_expected_keys_accepts_any_json(self):
+        self.assertTrue(has_keys('[1]', ()))
+        self.assertFalse(has_keys('not json', ()))
+
+
+if __name__ == '__main__':
+    unittest.main()
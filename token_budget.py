@@ -0,0 +1,246 @@
+"""
+Token budgeting for the analysis LLM calls in app.py.
+
+Input tokens are counted with tiktoken when it is installed (OpenAI and
+DeepSeek models) and otherwise approximated from the character count with a
+per-provider ratio. Output limits follow the size of the JSON the prompt asks
+for (number of criteria and analysis depth), not the length of the paper,
+and inputs that would not fit the model's context window are trimmed. Long
+documents are split into section-aware chunks for map-reduce analysis.
+"""
+import math
+import re
+
+# Characters per token of the providers' tokenizers on English scientific text
+CHARS_PER_TOKEN = {'claude': 3.5, 'openai': 4.0, 'deepseek': 3.8}
+
+# (model name prefix, context window, maximum output tokens, largest output budget requested without
+# streaming); the longest matching prefix wins. The Anthropic SDK refuses non-streaming calls that may
+# run over 10 minutes (max_tokens above 21333, 8192 for Opus 4); for the other providers streaming
+# keeps long answers clear of the HTTP read timeout.
+MODEL_LIMITS = [
+    ('claude-3-7', 200000, 64000, 21333),
+    ('claude-3-5', 200000, 8192, 8192),
+    ('claude-sonnet-4', 200000, 64000, 21333),
+    ('claude-opus-4', 200000, 32000, 8192),
+    ('claude', 200000, 4096, 4096),
+    ('gpt-4o', 128000, 16384, 16384),
+    ('gpt-4.1', 1000000, 32768, 16000),
+    ('gpt-4-1106-preview', 128000, 4096, 4096),
+    ('gpt-4-turbo', 128000, 4096, 4096),
+    ('gpt-4', 8192, 4096, 4096),
+    ('gpt-5', 400000, 128000, 16000),
+    ('o1', 200000, 100000, 16000),
+    ('o1-mini', 128000, 65536, 16000),
+    ('o3', 200000, 100000, 16000),
+    ('o3-mini', 200000, 100000, 16000),
+    ('o4', 200000, 100000, 16000),
+    ('o4-mini', 200000, 100000, 16000),
+    ('deepseek-reasoner', 64000, 32000, 16000),
+    ('deepseek', 64000, 8192, 8192),
+]
+DEFAULT_LIMITS = ('', 128000, 4096, 4096)
+
+# Output tokens per criterion and for the rest of the review JSON, by analysis depth
+TOKENS_PER_CRITERION = {'Quick': 90, 'Standard': 160, 'Detailed': 320}
+BASE_OUTPUT_TOKENS = {'Quick': 500, 'Standard': 900, 'Detailed': 1600}
+OUTPUT_MARGIN = 1.5
+MIN_OUTPUT_TOKENS = 1024
+
+# Reasoning models spend part of max_tokens/max_completion_tokens on hidden chain of thought:
+# they get at least REASONING_MIN_TOKENS more, growing with the input
+REASONING_MODELS = ('o1', 'o3', 'o4', 'gpt-5', 'deepseek-reasoner')
+REASONING_MIN_TOKENS = 8000
+REASONING_PER_INPUT_TOKEN = 0.25
+
+TRIM_MARKER = "\n\n[... middle of the document omitted to fit the context window ...]\n\n"
+
+# Numbered ("2.1 Methods", "IV. Results"), well-known ("Discussion") or ALL CAPS heading lines
+SECTION_HEADING = re.compile(
+    r'^[ \t]*(?:'
+    r'(?:\d{1,2}(?:\.\d{1,2})*\.?|[IVX]{1,4}\.)[ \t]+[A-Z][^\n]{0,70}[^\n.,;]'
+    r'|(?i:abstract|summary|introduction|background|methods?|materials and methods|methodology|results'
+    r'|results and discussion|discussion|conclusions?|limitations|acknowledge?ments|references'
+    r'|bibliography|literature cited):?'
+    r'|(?:Appendix|APPENDIX)(?:[ \t]+[A-Z0-9][^\n]{0,40})?'
+    r'|[A-Z][A-Z \t&,:-]{3,60}'
+    r')[ \t]*$', re.MULTILINE)
+REFERENCE_SECTIONS = ('references', 'bibliography', 'literature cited')
+
+_encodings = {}
+
+
+def provider_of(model_name):
+    name = (model_name or "").lower()
+    if 'claude' in name:
+        return 'claude'
+    if 'deepseek' in name:
+        return 'deepseek'
+    return 'openai'
+
+
+def _limits(model_name):
+    name = (model_name or "").lower()
+    matches = [limits for limits in MODEL_LIMITS if name.startswith(limits[0])]
+    return max(matches, key=lambda limits: len(limits[0])) if matches else DEFAULT_LIMITS
+
+
+def model_limits(model_name):
+    """(context window, maximum output tokens) of a model."""
+    _, window, output, _ = _limits(model_name)
+    return window, output
+
+
+def streaming_threshold(model_name):
+    """Output budget above which calls to the model are streamed."""
+    return _limits(model_name)[3]
+
+
+def _encoding(model_name):
+    """tiktoken encoding for OpenAI-style models, or None when tiktoken is not installed."""
+    if model_name not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encodings[model_name] = None
+    return _encodings[model_name]
+
+
+def count_tokens(text, model_name):
+    """Input tokens of `text` for the given model (exact with tiktoken, approximate otherwise)."""
+    if not text:
+        return 0
+    provider = provider_of(model_name)
+    if provider != 'claude':
+        encoding = _encoding(model_name)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN[provider])
+
+
+def expected_output_tokens(prompt_text, model_name):
+    """
+    Output budget for the review JSON requested in `prompt_text`: one entry
+    per criterion listed as "- **name**" plus the summary fields, scaled by
+    the "Analysis Depth" of the prompt and capped at the model's maximum.
+    """
+    depth_match = re.search(r'Analysis Depth:\s*(\w+)', prompt_text or '')
+    depth = depth_match.group(1) if depth_match and depth_match.group(1) in TOKENS_PER_CRITERION else 'Standard'
+    # top-level "- **name**" lines only, not the indented "  - **Guide:**" under each
+    criteria = len(re.findall(r'^- \*\*', prompt_text or '', flags=re.MULTILINE))
+    estimate = (BASE_OUTPUT_TOKENS[depth] + TOKENS_PER_CRITERION[depth] * max(criteria, 1)) * OUTPUT_MARGIN
+    return min(max(int(estimate), MIN_OUTPUT_TOKENS), model_limits(model_name)[1])
+
+
+def is_reasoning_model(model_name):
+    return (model_name or "").lower().startswith(REASONING_MODELS)
+
+
+def reasoning_allowance(input_tokens, model_name):
+    """Extra output tokens for the hidden reasoning of reasoning models (0 for the others)."""
+    if not is_reasoning_model(model_name):
+        return 0
+    return max(REASONING_MIN_TOKENS, int(input_tokens * REASONING_PER_INPUT_TOKEN))
+
+
+def plan(text, system_prompt, model_name, output_tokens=None):
+    """
+    Budget of one call: {'input_tokens', 'output_tokens' (answer plus any
+    reasoning allowance), 'reasoning_tokens', 'context_window', 'overflow'
+    (input tokens over the window), 'stream'}.
+    """
+    window, max_output = model_limits(model_name)
+    input_tokens = count_tokens(text, model_name) + count_tokens(system_prompt or "", model_name)
+    if output_tokens is None:
+        output_tokens = expected_output_tokens(text, model_name)
+    reasoning_tokens = reasoning_allowance(input_tokens, model_name)
+    output_tokens = min(output_tokens + reasoning_tokens, max_output)
+    return {
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'reasoning_tokens': reasoning_tokens,
+        'context_window': window,
+        'overflow': max(0, input_tokens + output_tokens - window),
+        'stream': output_tokens > streaming_threshold(model_name),
+    }
+
+
+def trim_to_fit(text, budget, model_name):
+    """Cut the middle of `text` so the call fits the window; the prompt at the start and the conclusions stay."""
+    if not budget['overflow']:
+        return text
+    keep_tokens = count_tokens(text, model_name) - budget['overflow'] - count_tokens(TRIM_MARKER, model_name)
+    keep_chars = max(0, int(len(text) * keep_tokens / max(count_tokens(text, model_name), 1) * 0.98))
+    head = keep_chars * 2 // 3
+    return text[:head] + TRIM_MARKER + text[len(text) - (keep_chars - head):]
+
+
+def split_sections(text):
+    """[(heading, body)] of a document, in order; the text before the first heading has an empty heading."""
+    sections = []
+    heading, start = '', 0
+    for match in SECTION_HEADING.finditer(text):
+        sections.append((heading, text[start:match.start()]))
+        heading, start = match.group(0).strip(), match.end()
+    sections.append((heading, text[start:]))
+    return [(heading, body.strip()) for heading, body in sections if body.strip()]
+
+
+def _split_oversized(body, model_name, chunk_tokens):
+    """Pieces of a section longer than one chunk: whole paragraphs where possible."""
+    pieces, current = [], ''
+    for paragraph in re.split(r'\n\s*\n', body):
+        if count_tokens(paragraph, model_name) > chunk_tokens:
+            step = max(1, int(len(paragraph) * chunk_tokens / count_tokens(paragraph, model_name)))
+            parts = [paragraph[i:i + step] for i in range(0, len(paragraph), step)]
+        else:
+            parts = [paragraph]
+        for part in parts:
+            if current and count_tokens(current + '\n\n' + part, model_name) > chunk_tokens:
+                pieces.append(current)
+                current = part
+            else:
+                current = f"{current}\n\n{part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_document(text, model_name, chunk_tokens):
+    """
+    Consecutive sections packed into chunks of at most `chunk_tokens`, as
+    [{'headings': [...], 'text': ...}]. The reference list is left out and a
+    section longer than a chunk is split between paragraphs.
+    """
+    chunks, headings, parts, tokens = [], [], [], 0
+
+    def flush():
+        if parts:
+            chunks.append({'headings': list(headings), 'text': '\n\n'.join(parts)})
+        headings.clear()
+        parts.clear()
+
+    for heading, body in split_sections(text):
+        if heading.rstrip(':').lower() in REFERENCE_SECTIONS:
+            continue
+        section = f"{heading}\n{body}" if heading else body
+        section_tokens = count_tokens(section, model_name)
+        if section_tokens > chunk_tokens:
+            flush()
+            for piece in _split_oversized(section, model_name, chunk_tokens):
+                chunks.append({'headings': [heading] if heading else [], 'text': piece})
+            tokens = 0
+            continue
+        if tokens + section_tokens > chunk_tokens:
+            flush()
+            tokens = 0
+        if heading:
+            headings.append(heading)
+        parts.append(section)
+        tokens += section_tokens
+    flush()
+    return chunks